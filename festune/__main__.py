@@ -1,14 +1,65 @@
 # coding: utf-8
+"""
+Command line interface.
+
+Modules which are slow to import (numpy, spotipy, ...) are only imported by the
+actions needing them.
+"""
+import argparse
+import dataclasses
+import datetime
 import itertools
 import sys
+import time
 
+import festune.data
 import festune.index
-import festune.spotify
+import festune.outbox
 import festune.playlist
-
+import festune.search
 import settings
 
 
+#: Actions which expect an argument, given after the name of the action
+ACTIONS_WITH_ARGUMENT = frozenset(("query", "search", "history"))
+
+#: Actions which require an access to the network
+ONLINE_ACTIONS = frozenset(("update_rotating", "covers",
+                            "resolve_duplicates", "update_smart"))
+
+#: Actions listed in the usage message
+USAGE = (
+    "find_duplicates",
+    "update_rotating",
+    "resolve_duplicates [--dry-run]",
+    "gc [--dry-run]",
+    "update_smart",
+    "export",
+    "query <expression>",
+    "stats",
+    "covers",
+    "search <query>",
+    "history <playlist> [--at <date>]",
+)
+
+
+@dataclasses.dataclass
+class Context:
+    """
+    State shared by the actions.
+    """
+    args: argparse.Namespace
+    playlists: festune.index.FestonPlaylistsIndex
+    tracks: festune.index.TracksIndex
+    outbox: festune.outbox.Outbox
+    #: Spotify client, ``None`` when offline
+    spotify: object = None
+    #: See :func:`festune.index.refresh_indexes()`
+    refreshed_tracks: dict = None
+    #: Time spent loading the tracks from the disk, in seconds
+    load_time: float = 0.
+
+
 def find_new_duplicates(refreshed_tracks, tracks):
     duplicates = festune.index.TracksIndex()
 
@@ -37,56 +88,411 @@ def list_last_tracks(playlists, tracks, max_nb=30):
     return itertools.chain.from_iterable(reversed(last_tracks))
 
 
-def main():
-    actions = set(sys.argv)
+def print_stats(report):
+    print("Top artists:")
+    for artist, count in report["top_artists"]:
+        print(f"\t* {artist} ({count})")
 
-    if not actions:
-        print("You need to specify one or more actions in:", file=sys.stderr)
-        print("\t* find_duplicates", file=sys.stderr)
-        print("\t* update_rotating", file=sys.stderr)
+    for i, month in enumerate(report["months"]):
+        print(f"{month}: {report['tracks_per_month'][i]} tracks, "
+              f"{report['repeat_rate'][i]:.0%} repeated, "
+              f"{report['duplicate_rate'][i]:.0%} duplicated")
+
+        top = report["top_artists_per_month"][month][:3]
+        print("\tTop artists: " + ", ".join(
+            f"{artist} ({count})" for artist, count in top))
+
+        similarities = [
+            (similarity, other) for other, similarity
+            in zip(report["months"], report["artists_jaccard"][i])
+            if other != month]
+        if similarities:
+            similarity, other = max(similarities)
+            print(f"\tClosest month by artists: {other} ({similarity:.2f})")
+
+
+def parse_actions(argv):
+    """
+    Return a dict {action: argument} from the command line arguments. The
+    argument is ``None`` for actions which don't expect one.
+    """
+    actions = {}
+    argv = iter(argv)
+    for action in argv:
+        actions[action] = None
+
+        if action in ACTIONS_WITH_ARGUMENT:
+            actions[action] = next(argv, None)
+            if actions[action] is None:
+                raise ValueError(f"Action {action} expects an argument")
+
+    return actions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="festune")
+    parser.add_argument("actions", nargs="*", metavar="action")
+    parser.add_argument(
+        "--offline", action="store_true",
+        help="don't connect to Spotify, use the data on disk only")
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="show the changes without applying them")
+    parser.add_argument(
+        "--at", type=datetime.datetime.fromisoformat,
+        default=datetime.datetime.now(),
+        help="date (ISO 8601) at which the history of a playlist is shown")
+
+    return parser.parse_intermixed_args(argv)
+
+
+def run_find_duplicates(context):
+    duplicates = find_new_duplicates(
+        itertools.chain.from_iterable(context.refreshed_tracks.values()),
+        context.tracks)
+
+    for track in duplicates:
+        print(f"Track {track.artists[0]} - {track.name} is a duplicate, "
+              "in:")
+
+        for playlist in duplicates.playlists_of(track):
+            print(f"\t* {context.playlists.find_by_id(playlist).name}")
+
+    if not duplicates:
+        print("No new duplicate found")
+
+
+def run_resolve_duplicates(context):
+    import festune.changelog
+    import festune.duplicates
+    import festune.history
+
+    policy = getattr(settings, "DUPLICATES_POLICY", "oldest")
+    if policy not in festune.duplicates.POLICIES:
+        print(f"Unknown DUPLICATES_POLICY {policy!r}, expected one of: "
+              f"{', '.join(festune.duplicates.POLICIES)}", file=sys.stderr)
         return
 
-    spotify = festune.spotify.get_spotify()
+    removals = festune.duplicates.plan_removals(
+        context.playlists, context.tracks, policy)
 
-    # Load from disk
-    playlists = festune.index.FestonPlaylistsIndex()
-    tracks = festune.index.TracksIndex()
+    if not removals:
+        print("No duplicate found")
+        return
+
+    changelog = festune.changelog.ChangeLog.load()
+    history = festune.history.History()
+    for playlist, occurrences in removals.items():
+        print(f"Removing {len(occurrences)} duplicate(s) from "
+              f"{playlist.name}:")
+        for position, track in sorted(occurrences.items()):
+            print(f"\t* {track.artists[0]} - {track.name} (#{position + 1})")
+
+        if context.args.dry_run:
+            continue
+
+        try:
+            festune.duplicates.remove_occurrences(
+                context.spotify, playlist, occurrences, context.tracks,
+                changelog, history)
+        except Exception as exc:  # noqa
+            print(f"Failed to update {playlist.name}: {exc}",
+                  file=sys.stderr)
+
+
+def run_update_rotating(context):
+    if not settings.ROTATING_PLAYLIST:
+        print("Rotating playlist id missing from settings")
+        return
+
+    rotating_tracks = list_last_tracks(context.playlists, context.tracks)
+    context.outbox.replace(
+        *settings.ROTATING_PLAYLIST,
+        [track.object_id for track in rotating_tracks])
+
+    print("Rotating playlist update queued")
+
+
+def drain_outbox(spotify, outbox):
+    if not outbox:
+        return
+
+    nb_sent = outbox.drain(spotify)
+    print(f"{nb_sent} playlist update(s) sent")
+    if outbox:
+        print(f"{len(outbox)} playlist update(s) still pending, they will be "
+              "sent by the next run", file=sys.stderr)
+
+
+def run_update_smart(context):
+    import festune.changelog
+    import festune.features
+    import festune.rules
+
+    rules = [festune.rules.Rule(**rule)
+             for rule in getattr(settings, "SMART_PLAYLISTS", [])]
+    if not rules:
+        print("No smart playlist in settings")
+        return
+
+    excluded = festune.rules.ExcludedPlaylists.load()
+    excluded.refresh(context.spotify,
+                     {text for rule in rules for text in rule.exclude})
+
+    updates = festune.rules.update_smart_playlists(
+        context.outbox, rules, context.playlists, context.tracks,
+        festune.changelog.ChangeLog.load(),
+        festune.features.AudioFeaturesCache.load(), excluded=excluded)
+
+    for rule, nb_checked, to_add, to_remove in updates:
+        print(f"Smart playlist {rule.name}: {nb_checked} track(s) checked, "
+              f"{len(to_add)} added, {len(to_remove)} removed")
+
+
+def run_export(context):
+    import festune.columnar
+
+    path = festune.columnar.export(context.playlists, context.tracks)
+    print(f"Library exported in {path}")
+
+
+def run_query(context, expression):
+    import festune.query
+
+    try:
+        matching = festune.query.Query(
+            context.playlists, context.tracks).find(expression)
+    except festune.query.Error as error:
+        print(f"Invalid query: {error}", file=sys.stderr)
+        return
+
+    for track in matching:
+        print(f"{track.artists[0]} - {track.name}")
 
-    playlists.add_all(festune.playlist.FestonPlaylist.load_all())
-    tracks.add_all(festune.playlist.PlaylistTrack.load_all())
+    print(f"{len(matching)} track(s) found")
 
-    # Refresh playlists to see new changes
+
+def run_covers(context):
+    import festune.covers
+
+    cache = festune.covers.CoverCache.load()
+    nb_downloaded = cache.refresh(context.playlists)
+    print(f"{nb_downloaded} cover(s) downloaded, cache size: "
+          f"{cache.size // 1024} KiB")
+
+
+def run_search(context, query):
+    matching = festune.search.search(context.tracks, query)
+
+    for track in matching:
+        print(f"{', '.join(track.artists)} - {track.name}, in:")
+        for playlist in context.tracks.playlists_of(track):
+            if playlist in context.playlists:
+                print(f"\t* {context.playlists.find_by_id(playlist).name}")
+
+    print(f"{len(matching)} track(s) found")
+
+
+def find_playlist(playlists, name):
+    """
+    Find a playlist by name, id or date (``YYYY-MM``), return ``None`` if it
+    can't be found.
+    """
+    for playlist in playlists:
+        if name in (playlist.name, playlist.object_id,
+                    f"{playlist.year:04d}-{playlist.month:02d}"):
+            return playlist
+
+    return None
+
+
+def run_history(context, name):
+    import festune.history
+
+    at = context.args.at
+    playlist = find_playlist(context.playlists, name)
+    if not playlist:
+        print(f"Unknown playlist {name}", file=sys.stderr)
+        return
+
+    history = festune.history.History().of(playlist)
+    index = history.find_version(at.timestamp())
+    if index is None:
+        print(f"No version of {playlist.name} recorded before {at}")
+        return
+
+    version = history.versions[index]
+    recorded_at = datetime.datetime.fromtimestamp(version["time"])
+    print(f"{playlist.name} at {at} (snapshot {version['snapshot_id']}, "
+          f"recorded at {recorded_at}):")
+
+    for position, track_id in enumerate(history.tracks_of(index)):
+        try:
+            track = context.tracks.find_by_id(track_id)
+            print(f"{position + 1}. {track.artists[0]} - {track.name}")
+        except KeyError:
+            print(f"{position + 1}. {track_id}")
+
+
+def run_gc(context):
+    import festune.compaction
+
+    dry_run = context.args.dry_run
+    report = festune.compaction.collect(context.tracks, context.load_time,
+                                        dry_run)
+    if not report.nb_orphans:
+        print("No orphaned track")
+        return
+
+    print(f"{'Would remove' if dry_run else 'Removed'} {report.nb_orphans} "
+          f"orphaned track(s) out of {report.nb_tracks}: "
+          f"{report.size / 1024:.1f} KiB, about {report.load_time:.2f}s of "
+          "loading")
+
+
+def run_stats(context):
+    import festune.stats
+
+    print_stats(festune.stats.get_report(context.playlists, context.tracks))
+
+
+def refresh(playlists, tracks):
+    """
+    Connect to Spotify and refresh the indexes, return the client and the
+    refreshed tracks (see :func:`festune.index.refresh_indexes()`).
+    """
+    import festune.changelog
+    import festune.history
+    import festune.spotify
+    import festune.tracing
+
+    spotify = festune.spotify.get_spotify(festune.tracing.Tracer.load())
     refreshed_tracks = festune.index.refresh_indexes(
-        spotify, playlists, tracks)
+        spotify, playlists, tracks, festune.changelog.ChangeLog.load(),
+        festune.history.History())
 
     if not refreshed_tracks:
         print("Nothing to do after refresh")
 
-    if "find_duplicates" in actions:
-        # Display duplicates
-        duplicates = find_new_duplicates(
-            itertools.chain.from_iterable(refreshed_tracks.values()), tracks)
+    if getattr(settings, "ENRICH_AUDIO_FEATURES", False):
+        import festune.features
+
+        cache = festune.features.AudioFeaturesCache.load()
+        nb_fetched, errors = cache.enrich(spotify, tracks)
+        if nb_fetched:
+            print(f"Audio features fetched for {nb_fetched} track(s)")
 
-        for track in duplicates:
-            print(f"Track {track.artists[0]} - {track.name} is a duplicate, "
-                  "in:")
+        for error in errors:
+            print(f"Failed to fetch audio features: {error}",
+                  file=sys.stderr)
 
-            for playlist in duplicates.playlists_of(track):
-                print(f"\t* {playlists.find_by_id(playlist).name}")
+    return spotify, refreshed_tracks
 
-        if not duplicates:
-            print("No new duplicate found")
 
-    if "update_rotating" in actions:
-        if not settings.ROTATING_PLAYLIST:
-            print("Rotating playlist id missing from settings")
+def needs_gc(tracks):
+    import festune.compaction
+
+    return festune.compaction.needs_collection(tracks, getattr(
+        settings, "GC_THRESHOLD",
+        festune.compaction.AUTO_COLLECTION_THRESHOLD))
+
+
+#: Handlers of the actions which may update playlists, run before the outbox
+#: is drained, in this order
+UPDATE_HANDLERS = {
+    "gc": run_gc,
+    "find_duplicates": run_find_duplicates,
+    "resolve_duplicates": run_resolve_duplicates,
+    "update_rotating": run_update_rotating,
+    "update_smart": run_update_smart,
+}
+
+#: Handlers of the other actions, run after the outbox is drained, in this
+#: order
+READ_HANDLERS = {
+    "export": run_export,
+    "query": run_query,
+    "stats": run_stats,
+    "covers": run_covers,
+    "search": run_search,
+    "history": run_history,
+}
+
+
+def run_actions(handlers, context, actions):
+    """
+    Run the handlers of the ``actions`` found in ``handlers``.
+    """
+    for action, handler in handlers.items():
+        if action not in actions:
+            continue
+
+        if action in ACTIONS_WITH_ARGUMENT:
+            handler(context, actions[action])
         else:
-            rotating_tracks = list_last_tracks(playlists, tracks)
-            spotify.user_playlist_replace_tracks(
-                *settings.ROTATING_PLAYLIST,
-                [track.object_id for track in rotating_tracks])
+            handler(context)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    try:
+        actions = parse_actions(args.actions)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return
+
+    if not actions:
+        print("You need to specify one or more actions in:", file=sys.stderr)
+        for usage in USAGE:
+            print(f"\t* {usage}", file=sys.stderr)
+        return
+
+    if args.offline and ONLINE_ACTIONS.intersection(actions):
+        print("Actions not available offline: "
+              f"{', '.join(ONLINE_ACTIONS.intersection(actions))}",
+              file=sys.stderr)
+        return
+
+    if festune.data.recover():
+        print("Writes interrupted during the previous run have been replayed")
+
+    # Load from disk
+    context = Context(args, festune.index.FestonPlaylistsIndex(),
+                      festune.index.TracksIndex(
+                          festune.search.SearchIndex.load()),
+                      festune.outbox.Outbox.load())
+
+    context.playlists.add_all(festune.playlist.FestonPlaylist.load_all())
+    start = time.perf_counter()
+    context.tracks.add_all(festune.playlist.PlaylistTrack.load_all())
+    context.load_time = time.perf_counter() - start
+
+    if args.offline:
+        # Without refresh, all tracks are considered
+        context.refreshed_tracks = {None: context.tracks}
+    else:
+        # Refresh playlists to see new changes
+        context.spotify, context.refreshed_tracks = refresh(
+            context.playlists, context.tracks)
+
+        # Updates which failed during a previous run
+        drain_outbox(context.spotify, context.outbox)
+
+        if (not args.dry_run and "gc" not in actions
+                and needs_gc(context.tracks)):
+            print("Many tracks are orphaned, collecting them")
+            run_gc(context)
+
+    if context.tracks.search_index.dirty:
+        context.tracks.search_index.save()
+
+    run_actions(UPDATE_HANDLERS, context, actions)
+
+    if context.spotify:
+        drain_outbox(context.spotify, context.outbox)
+        context.spotify.tracer.save()
 
-            print("Rotating playlist has been updated")
+    run_actions(READ_HANDLERS, context, actions)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,85 @@
+# coding: utf-8
+"""
+Sets of small integers stored as bitmaps.
+
+A :class:`Bitmap` stores bit ``i`` if ``i`` is in the set. Adding or removing
+a value is done in place in constant time, while set operations are performed
+on the whole bitmap at once by converting it to a Python integer, which is
+much faster than the same operations on sets of objects.
+"""
+
+
+class Bitmap:
+    """
+    A mutable set of non-negative integers.
+
+    Supports ``|``, ``&``, ``-``, ``^`` (which return new bitmaps), ``in``,
+    ``len()`` and iteration (in increasing order).
+    """
+    __slots__ = ("data", )
+
+    def __init__(self, data=b""):
+        self.data = bytearray(data)
+
+    @classmethod
+    def from_int(cls, bits):
+        return cls(bits.to_bytes((bits.bit_length() + 7) // 8, "little"))
+
+    @classmethod
+    def from_iterable(cls, values):
+        bitmap = cls()
+        for value in values:
+            bitmap.add(value)
+
+        return bitmap
+
+    def to_int(self):
+        return int.from_bytes(self.data, "little")
+
+    def add(self, value):
+        byte_index, bit = divmod(value, 8)
+        if byte_index >= len(self.data):
+            self.data.extend(bytes(byte_index - len(self.data) + 1))
+
+        self.data[byte_index] |= 1 << bit
+
+    def discard(self, value):
+        byte_index, bit = divmod(value, 8)
+        if byte_index < len(self.data):
+            self.data[byte_index] &= ~(1 << bit) & 0xff
+
+    def __or__(self, other):
+        return self.from_int(self.to_int() | other.to_int())
+
+    def __and__(self, other):
+        return self.from_int(self.to_int() & other.to_int())
+
+    def __sub__(self, other):
+        return self.from_int(self.to_int() & ~other.to_int())
+
+    def __xor__(self, other):
+        return self.from_int(self.to_int() ^ other.to_int())
+
+    def __contains__(self, value):
+        byte_index, bit = divmod(value, 8)
+        return (0 <= byte_index < len(self.data)
+                and bool(self.data[byte_index] & (1 << bit)))
+
+    def __len__(self):
+        return bin(self.to_int()).count("1")
+
+    def __bool__(self):
+        return any(self.data)
+
+    def __eq__(self, other):
+        return isinstance(other, Bitmap) and self.to_int() == other.to_int()
+
+    def __iter__(self):
+        for byte_index, byte in enumerate(self.data):
+            while byte:
+                low_bit = byte & -byte
+                yield byte_index * 8 + low_bit.bit_length() - 1
+                byte ^= low_bit
+
+    def __repr__(self):
+        return f"Bitmap({list(self)!r})"
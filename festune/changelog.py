@@ -0,0 +1,234 @@
+# coding: utf-8
+"""
+Append-only log of the changes of the playlists seen during refreshes.
+
+Each refreshed playlist appends a :class:`Change` to the log, with a sequence
+number. Consumers read the changes after the last sequence number they
+processed (their cursor), and may acknowledge it with :meth:`ChangeLog.ack()`
+so that older changes can be compacted.
+"""
+from typing import List, Optional, Tuple
+
+import bisect
+import dataclasses
+import json
+import time
+
+import festune.data
+import festune.exceptions
+import festune.playlist
+
+
+#: Name of the log file
+CHANGELOG_FILE = "changes.log"
+
+#: Name of the file storing the cursors of consumers
+CURSORS_FILE = "changes-cursors.json"
+
+#: Maximum number of changes kept after a compaction, even if some consumers
+#: didn't read them
+MAX_CHANGES = 10000
+
+#: The log is compacted when it contains this many changes
+COMPACTION_THRESHOLD = 2 * MAX_CHANGES
+
+
+class Error(festune.exceptions.Error):
+    pass
+
+
+class CursorExpired(Error):
+    """
+    Changes after the cursor have been compacted, the consumer must rebuild
+    its state from the indexes.
+    """
+
+
+@dataclasses.dataclass
+class Change:
+    seq: int
+    time: float
+    #: (user_id, playlist_id)
+    playlist: Tuple[str, str]
+    old_snapshot_id: Optional[str]
+    new_snapshot_id: Optional[str]
+    #: list of (track_id, position)
+    added: List[Tuple[str, int]]
+    #: list of (track_id, position)
+    removed: List[Tuple[str, int]]
+    #: list of (track_id, old position, new position)
+    moved: List[Tuple[str, int, int]]
+
+    @classmethod
+    def from_json(cls, change_json):
+        change = cls(**change_json)
+        change.playlist = tuple(change.playlist)
+        return change
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.moved)
+
+
+def _stable_tracks(positions):
+    """
+    Return the indices of the longest increasing subsequence of
+    ``positions``.
+    """
+    tails = []
+    tails_indices = []
+    previous = [None] * len(positions)
+
+    for i, position in enumerate(positions):
+        length = bisect.bisect_left(tails, position)
+        if length == len(tails):
+            tails.append(position)
+            tails_indices.append(i)
+        else:
+            tails[length] = position
+            tails_indices[length] = i
+
+        previous[i] = tails_indices[length - 1] if length else None
+
+    stable = set()
+    i = tails_indices[-1] if tails_indices else None
+    while i is not None:
+        stable.add(i)
+        i = previous[i]
+
+    return stable
+
+
+def diff(old_tracks, new_tracks):
+    """
+    Compute the changes between two versions of a playlist.
+
+    Tracks which are only shifted because other tracks have been added or
+    removed are not considered as moved: moved tracks are the minimal set of
+    tracks which must be moved to get the new order.
+
+    :param old_tracks: dict {position: track} of the previous version
+    :param new_tracks: dict {position: track} of the new version
+    :return: a tuple (added, removed, moved) as in :class:`Change`
+    """
+    old_positions = {t.object_id: pos for pos, t in old_tracks.items()}
+    new_positions = {t.object_id: pos for pos, t in new_tracks.items()}
+
+    added = sorted(((track_id, pos) for track_id, pos in new_positions.items()
+                    if track_id not in old_positions), key=lambda t: t[1])
+    removed = sorted(((track_id, pos)
+                      for track_id, pos in old_positions.items()
+                      if track_id not in new_positions), key=lambda t: t[1])
+
+    kept = sorted((pos, track_id) for track_id, pos in old_positions.items()
+                  if track_id in new_positions)
+    stable = _stable_tracks([new_positions[track_id] for _, track_id in kept])
+    moved = [(track_id, pos, new_positions[track_id])
+             for i, (pos, track_id) in enumerate(kept) if i not in stable]
+
+    return added, removed, moved
+
+
+class ChangeLog:
+    """
+    Log of :class:`Change`, stored in a file of the data directory with one
+    json object per line.
+    """
+    def __init__(self, path=CHANGELOG_FILE, cursors_path=CURSORS_FILE):
+        self.path = path
+        self.cursors_path = cursors_path
+        self.changes = []
+        self.cursors = {}
+
+    @classmethod
+    def load(cls, path=CHANGELOG_FILE, cursors_path=CURSORS_FILE):
+        changelog = cls(path, cursors_path)
+
+        try:
+            with festune.data.open_file(path, "r") as log_file:
+                for line in log_file:
+                    try:
+                        changelog.changes.append(
+                            Change.from_json(json.loads(line)))
+                    except ValueError:
+                        # Truncated by a crash during the last append, the
+                        # partial line must be removed before appending
+                        changelog._rewrite()
+                        break
+        except FileNotFoundError:
+            pass
+
+        changelog.cursors = festune.data.read_json(cursors_path, {})
+        return changelog
+
+    @property
+    def last_cursor(self):
+        """
+        Sequence number of the last change, 0 if the log is empty.
+        """
+        return self.changes[-1].seq if self.changes else 0
+
+    def append(self, playlist, old_snapshot_id, new_snapshot_id, old_tracks,
+               new_tracks):
+        """
+        Append the changes between two versions of ``playlist`` to the log.
+        See :func:`diff()` for ``old_tracks`` and ``new_tracks``.
+
+        Return the :class:`Change`, or ``None`` if the tracks didn't change.
+        """
+        if isinstance(playlist, festune.playlist.Playlist):
+            playlist = (playlist.user_id, playlist.object_id)
+
+        change = Change(self.last_cursor + 1, time.time(), playlist,
+                        old_snapshot_id, new_snapshot_id,
+                        *diff(old_tracks, new_tracks))
+        if not change:
+            return None
+
+        with festune.data.open_file(self.path, "a") as log_file:
+            log_file.write(json.dumps(dataclasses.asdict(change)) + "\n")
+
+        self.changes.append(change)
+
+        if len(self.changes) >= COMPACTION_THRESHOLD:
+            self.compact()
+
+        return change
+
+    def read_since(self, cursor):
+        """
+        Return the list of changes after ``cursor``.
+
+        :raise: :class:`CursorExpired` if some of these changes have been
+                compacted
+        """
+        if self.changes and cursor < self.changes[0].seq - 1:
+            raise CursorExpired(f"Changes after {cursor} have been compacted")
+
+        start = bisect.bisect_right([c.seq for c in self.changes], cursor)
+        return self.changes[start:]
+
+    def ack(self, consumer, cursor):
+        """
+        Mark the changes up to ``cursor`` as processed by ``consumer``.
+        """
+        self.cursors[consumer] = cursor
+        festune.data.write_file(self.cursors_path, json.dumps(self.cursors))
+
+    def compact(self, max_changes=MAX_CHANGES):
+        """
+        Drop the changes processed by all consumers, and keep at most
+        ``max_changes`` changes.
+        """
+        keep_after = min(self.cursors.values(), default=self.last_cursor)
+        changes = [c for c in self.changes if c.seq > keep_after]
+        changes = changes[-max_changes:] if max_changes else []
+
+        # Keep at least the last change: the sequence number is read from the
+        # log.
+        self.changes = changes or self.changes[-1:]
+        self._rewrite()
+
+    def _rewrite(self):
+        festune.data.write_file(self.path, "".join(
+            json.dumps(dataclasses.asdict(c)) + "\n" for c in self.changes))
+        festune.data.flush()
@@ -0,0 +1,146 @@
+# coding: utf-8
+"""
+Spotify API client.
+"""
+import collections.abc
+import threading
+import time
+
+import requests.adapters
+import spotipy
+import urllib3
+
+
+class _TimedRetry(urllib3.Retry):
+    """
+    Retry policy measuring the time spent waiting before retrying, in
+    ``wait`` (for the current thread).
+    """
+    wait = threading.local()
+
+    def sleep(self, response=None):
+        start = time.perf_counter()
+        try:
+            super().sleep(response)
+        finally:
+            self.wait.total = (getattr(self.wait, "total", 0.)
+                               + time.perf_counter() - start)
+
+
+class ResultWrapper(collections.abc.MutableMapping):
+    def __init__(self, client, result):
+        self.client = client
+        self.result = result
+
+    def __len__(self):
+        return len(self.result)
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def __getitem__(self, key):
+        return self.result[key]
+
+    def __contains__(self, key):
+        return key in self.result
+
+    def __setitem__(self, key, value):
+        self.result[key] = value
+
+    def __delitem__(self, key):
+        del self.result[key]
+
+    def __call__(self, method, *args, **kwargs):
+        getattr(self.result, method)(*args, **kwargs)
+
+    def __str__(self):
+        return str(self.result)
+
+    def __repr__(self):
+        return repr(self.result)
+
+    def paginate(self):
+        """
+        Iterate through the results and load the next page(s).
+        """
+        result = self.result
+        while result:
+            yield from result['items']
+            result = self.client.next(result)
+
+
+class Spotify(spotipy.Spotify):
+    """
+    Add pagination helpers to some requests::
+
+        for playlist in spotify.current_user_playlists().paginate():
+            pass
+
+    Each call to the API (reads, writes and pages loaded by :meth:`next()`)
+    is recorded by ``tracer``, a :class:`festune.tracing.Tracer`, if set.
+    """
+    def __init__(self, *args, tracer=None, **kwargs):
+        # Last response received by each thread
+        self._responses = threading.local()
+        self.tracer = tracer
+        super().__init__(*args, **kwargs)
+
+    def _build_session(self):
+        # Same session as spotipy's, with a retry policy measuring the time
+        # spent waiting, and a hook getting the responses
+        self._session = requests.Session()
+        retry = _TimedRetry(
+            total=self.retries,
+            connect=None,
+            read=False,
+            allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+            status=self.status_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.status_forcelist)
+
+        adapter = requests.adapters.HTTPAdapter(max_retries=retry)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.hooks["response"].append(self._on_response)
+
+    def _on_response(self, response, *args, **kwargs):
+        self._responses.last = response
+
+    def _internal_call(self, method, url, payload, params):
+        if self.tracer is None:
+            return super()._internal_call(method, url, payload, params)
+
+        self._responses.last = None
+        _TimedRetry.wait.total = 0.
+        status = None
+        start = time.perf_counter()
+        try:
+            return super()._internal_call(method, url, payload, params)
+        except spotipy.SpotifyException as exc:
+            status = exc.http_status
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            response = self._responses.last
+            size = retries = 0
+
+            if response is not None:
+                status = response.status_code
+                size = len(response.content)
+                retries = len(getattr(getattr(response.raw, "retries", None),
+                                      "history", ()))
+
+            self.tracer.record(method, url, status, size, latency, retries,
+                               _TimedRetry.wait.total)
+
+    def _get(self, url, args=None, payload=None, **kwargs):
+        result = super()._get(url, args, payload, **kwargs)
+
+        if result and "limit" in kwargs and "offset" in kwargs:
+            return ResultWrapper(self, result)
+
+        return result
+
+    def next(self, result):
+        result = super().next(result)
+        return ResultWrapper(self, result) if result else result
@@ -0,0 +1,307 @@
+# coding: utf-8
+"""
+Columnar export of the indexes, for analytics tools.
+
+The library is written in a directory as three tables, one sub-directory per
+table and one NumPy ``.npy`` file per column, so that each column can be
+memory-mapped:
+
+* ``tracks``: one row per track, the row number is the dense track id,
+* ``playlists``: one row per playlist, the row number is the dense playlist id,
+* ``memberships``: one row per occurrence of a track in a playlist, sorted by
+  playlist and position.
+
+Strings are dictionary-encoded: ``<column>.npy`` contains ``int32`` indices
+(``-1`` for null) in a dictionary stored with the Arrow layout of a string
+array, ``<column>.dictionary.offsets.npy`` (``int32``) and
+``<column>.dictionary.data.npy`` (utf-8 bytes). List columns also have a
+``<column>.offsets.npy`` file, like Arrow lists.
+
+``schema.json`` describes the tables and can be read without festune.
+"""
+from typing import Dict, Optional
+
+import dataclasses
+import json
+import pathlib
+
+import numpy
+
+import festune.data
+
+
+#: Name of the directory of the export in the data directory.
+DEFAULT_EXPORT_DIR = "export"
+
+#: Version of the layout written in ``schema.json``
+SCHEMA_VERSION = 1
+
+
+class StringArray:
+    """
+    An immutable array of strings, stored as Arrow stores them: the utf-8
+    bytes of all strings concatenated in ``data`` and the boundaries of each
+    string in ``offsets``.
+    """
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int32)
+        numpy.cumsum([len(string) for string in encoded], out=offsets[1:])
+        data = numpy.frombuffer(b"".join(encoded), dtype=numpy.uint8)
+        return cls(offsets, data)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class StringDictionary:
+    """
+    Assign an integer code to each distinct string.
+    """
+    def __init__(self):
+        self.codes = {}
+
+    def encode(self, value):
+        if value is None:
+            return -1
+
+        return self.codes.setdefault(value, len(self.codes))
+
+    def encode_all(self, values):
+        return numpy.fromiter((self.encode(value) for value in values),
+                              dtype=numpy.int32)
+
+    def to_array(self):
+        return StringArray.from_strings(self.codes)
+
+
+@dataclasses.dataclass
+class Column:
+    """
+    A column of a table.
+
+    If ``dictionary`` is set, ``values`` are the codes of strings in the
+    dictionary. If ``offsets`` is set, the column is a list column: row ``i``
+    is ``values[offsets[i]:offsets[i + 1]]``.
+    """
+    values: numpy.ndarray
+    dictionary: Optional[StringArray] = None
+    offsets: Optional[numpy.ndarray] = None
+
+    @classmethod
+    def from_strings(cls, strings, dictionary=None):
+        dictionary = dictionary or StringDictionary()
+        return cls(dictionary.encode_all(strings), dictionary.to_array())
+
+    @classmethod
+    def from_string_lists(cls, lists, dictionary=None):
+        dictionary = dictionary or StringDictionary()
+        offsets = numpy.zeros(len(lists) + 1, dtype=numpy.int32)
+        numpy.cumsum([len(values) for values in lists], out=offsets[1:])
+        values = dictionary.encode_all(
+            value for values in lists for value in values)
+        return cls(values, dictionary.to_array(), offsets)
+
+    @property
+    def type(self):
+        value_type = ("dictionary<string>" if self.dictionary is not None
+                      else str(self.values.dtype))
+        if self.offsets is not None:
+            return f"list<{value_type}>"
+
+        return value_type
+
+    def __len__(self):
+        if self.offsets is not None:
+            return len(self.offsets) - 1
+
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if self.offsets is not None:
+            start, end = self.offsets[index], self.offsets[index + 1]
+            return [self._decode(value) for value in self.values[start:end]]
+
+        return self._decode(self.values[index])
+
+    def _decode(self, value):
+        if self.dictionary is None:
+            return value.item()
+
+        return None if value < 0 else self.dictionary[value]
+
+
+#: A table is a mapping of column names to columns of the same length
+Table = Dict[str, Column]
+
+
+#: Columns of the ``tracks`` table
+TRACK_COLUMNS = ("object_id", "isrc", "name", "artists")
+
+
+def build_tables(playlists, tracks, track_columns=TRACK_COLUMNS):
+    """
+    Build the ``tracks``, ``playlists`` and ``memberships`` tables from a
+    :class:`festune.index.PlaylistsIndex` and a
+    :class:`festune.index.TracksIndex`.
+
+    :param track_columns: columns of the ``tracks`` table to build, all by
+                          default
+    """
+    all_tracks = list(tracks)
+    track_ids = {hash(track): i for i, track in enumerate(all_tracks)}
+    all_playlists = list(playlists)
+
+    membership_tracks = []
+    membership_playlists = []
+    membership_positions = []
+    for playlist_id, playlist in enumerate(all_playlists):
+        for position, track in sorted(tracks.tracks_of(playlist).items()):
+            membership_tracks.append(track_ids[hash(track)])
+            membership_playlists.append(playlist_id)
+            membership_positions.append(position)
+
+    def int_column(values):
+        return Column(numpy.array(values, dtype=numpy.int32))
+
+    playlists_table = {
+        "object_id": Column.from_strings(p.object_id for p in all_playlists),
+        "user_id": Column.from_strings(p.user_id for p in all_playlists),
+        "name": Column.from_strings(p.name for p in all_playlists),
+        "snapshot_id": Column.from_strings(
+            p.snapshot_id for p in all_playlists),
+        "nb_tracks": int_column([p.nb_tracks for p in all_playlists]),
+    }
+
+    # Only feston playlists are dated
+    if all(hasattr(p, "year") for p in all_playlists):
+        playlists_table["year"] = int_column([p.year for p in all_playlists])
+        playlists_table["month"] = int_column(
+            [p.month for p in all_playlists])
+
+    tracks_table = {}
+    for column in track_columns:
+        if column == "artists":
+            tracks_table[column] = Column.from_string_lists(
+                [t.artists for t in all_tracks])
+        else:
+            tracks_table[column] = Column.from_strings(
+                getattr(t, column) for t in all_tracks)
+
+    return {
+        "tracks": tracks_table,
+        "playlists": playlists_table,
+        "memberships": {
+            "track": int_column(membership_tracks),
+            "playlist": int_column(membership_playlists),
+            "position": int_column(membership_positions),
+        },
+    }
+
+
+def _save_array(path, array):
+    with festune.data.open_file(path, "wb") as array_file:
+        numpy.save(array_file, array, allow_pickle=False)
+
+
+def write_tables(tables, path=DEFAULT_EXPORT_DIR):
+    """
+    Write the ``tables`` in the directory ``path`` of the data directory.
+
+    :param tables: mapping of table names to :data:`Table`
+    :param path: directory, relative to the data directory
+    :return: the resolved path of the directory
+    """
+    path = pathlib.Path(path)
+    schema = {"version": SCHEMA_VERSION, "tables": {}}
+
+    for table_name, table in tables.items():
+        columns = {}
+        nb_rows = None
+
+        for column_name, column in table.items():
+            files = {"values": f"{table_name}/{column_name}.npy"}
+            _save_array(path / files["values"], column.values)
+
+            if column.offsets is not None:
+                files["offsets"] = f"{table_name}/{column_name}.offsets.npy"
+                _save_array(path / files["offsets"], column.offsets)
+
+            if column.dictionary is not None:
+                for part in ("offsets", "data"):
+                    name = f"{table_name}/{column_name}.dictionary.{part}.npy"
+                    files[f"dictionary.{part}"] = name
+                    _save_array(path / name, getattr(column.dictionary, part))
+
+            columns[column_name] = {"type": column.type, "files": files}
+            nb_rows = len(column)
+
+        schema["tables"][table_name] = {"rows": nb_rows or 0,
+                                        "columns": columns}
+
+    with festune.data.open_file(path / "schema.json", "w") as schema_file:
+        schema_file.write(json.dumps(schema, indent=2))
+
+    return festune.data.get_filename(path, create_parent=False)
+
+
+def read_tables(path=DEFAULT_EXPORT_DIR, mmap_mode="r"):
+    """
+    Read the tables written by :func:`write_tables()`.
+
+    :param path: directory of the export, relative to the data directory (or
+                 absolute)
+    :param mmap_mode: passed to :func:`numpy.load()`, arrays are memory-mapped
+                      by default, use ``None`` to load them in memory
+    :return: mapping of table names to :data:`Table`
+    """
+    path = festune.data.get_filename(path, create_parent=False)
+    with open(path / "schema.json", "r") as schema_file:
+        schema = json.loads(schema_file.read())
+
+    if schema["version"] != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported export version {schema['version']}")
+
+    def load(name):
+        return numpy.load(path / name, mmap_mode=mmap_mode,
+                          allow_pickle=False)
+
+    tables = {}
+    for table_name, table in schema["tables"].items():
+        tables[table_name] = {}
+        for column_name, column in table["columns"].items():
+            files = column["files"]
+            dictionary = offsets = None
+
+            if "dictionary.data" in files:
+                dictionary = StringArray(load(files["dictionary.offsets"]),
+                                         load(files["dictionary.data"]))
+
+            if "offsets" in files:
+                offsets = load(files["offsets"])
+
+            tables[table_name][column_name] = Column(
+                load(files["values"]), dictionary, offsets)
+
+    return tables
+
+
+def export(playlists, tracks, path=DEFAULT_EXPORT_DIR):
+    """
+    Export the indexes in the directory ``path`` of the data directory.
+
+    :return: the resolved path of the directory
+    """
+    return write_tables(build_tables(playlists, tracks), path)
@@ -0,0 +1,86 @@
+# coding: utf-8
+"""
+Remove the tracks which are not in any playlist anymore.
+
+When a track is removed from its last playlist, it stays on disk (with an
+empty ``playlists`` map): it is loaded, indexed and saved again by each run.
+:func:`collect()` removes these orphaned tracks from the index and from the
+disk, and rewrites the search index without them.
+
+:func:`needs_collection()` tells if enough tracks are orphaned to trigger a
+collection automatically.
+"""
+from typing import NamedTuple
+
+import os
+
+import festune.data
+
+
+#: A collection is triggered when this fraction of the tracks is orphaned
+AUTO_COLLECTION_THRESHOLD = 0.1
+
+
+class Report(NamedTuple):
+    #: Number of orphaned tracks
+    nb_orphans: int
+    #: Number of tracks in the index, including orphaned tracks
+    nb_tracks: int
+    #: Size of the files of the orphaned tracks, in bytes
+    size: int
+    #: Estimated time spent loading the orphaned tracks, in seconds
+    load_time: float
+
+
+def _size_of(track):
+    filename = festune.data.get_filename(
+        track.get_object_filename(object_type=track.object_type,
+                                  object_id=track.object_id),
+        create_parent=False)
+    try:
+        return os.path.getsize(filename)
+    except FileNotFoundError:
+        return 0
+
+
+def needs_collection(tracks, threshold=AUTO_COLLECTION_THRESHOLD):
+    """
+    Return ``True`` if at least the fraction ``threshold`` of the tracks of
+    the :class:`festune.index.TracksIndex` ``tracks`` is orphaned.
+    """
+    if threshold is None or not len(tracks):
+        return False
+
+    return len(tracks.orphans()) >= threshold * len(tracks)
+
+
+def collect(tracks, load_time=None, dry_run=False):
+    """
+    Remove the orphaned tracks of the :class:`festune.index.TracksIndex`
+    ``tracks`` from the index and from the disk, then save the search index.
+
+    Return a :class:`Report`.
+
+    :param load_time: time spent loading all the tracks, in seconds, used to
+                      estimate the time spent loading the orphaned tracks
+    :param dry_run: if ``True``, only return the report
+    """
+    orphans = tracks.orphans()
+    nb_tracks = len(tracks)
+
+    report = Report(
+        len(orphans), nb_tracks, sum(map(_size_of, orphans)),
+        load_time * len(orphans) / nb_tracks if load_time and nb_tracks
+        else 0.)
+
+    if dry_run or not orphans:
+        return report
+
+    tracks.discard_all(orphans)
+    for track in orphans:
+        festune.data.remove_file(track.get_object_filename(
+            object_type=track.object_type, object_id=track.object_id))
+
+    tracks.search_index.save()
+    festune.data.flush()
+    return report
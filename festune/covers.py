@@ -0,0 +1,201 @@
+# coding: utf-8
+"""
+Cache of the covers of playlists.
+
+Covers are downloaded concurrently and stored by the hash of their content, so
+a cover shared by several playlists is stored once. The cover of a playlist is
+downloaded again only when its ``snapshot_id`` changes. The total size of the
+cache is bounded, covers no playlist uses anymore are evicted first, then the
+least recently used covers.
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+import time
+import urllib.request
+
+import festune.data
+
+
+#: Directory of the cache in the data directory
+COVERS_DIR = pathlib.Path("covers")
+
+#: Maximum size of the cached covers, in bytes
+MAX_CACHE_SIZE = 100 * 1024 * 1024
+
+#: Maximum number of concurrent downloads
+MAX_CONCURRENT_DOWNLOADS = 8
+
+#: Timeout of a download, in seconds
+DOWNLOAD_TIMEOUT = 30
+
+
+def download(url):
+    """
+    Return the content at ``url``.
+    """
+    with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response:
+        return response.read()
+
+
+def pick_cover(images):
+    """
+    Return the :class:`festune.playlist.Image` to cache among ``images``, or
+    ``None``.
+    """
+    if not images or not images.images:
+        return None
+
+    try:
+        return images.biggest()
+    except TypeError:
+        # Spotify doesn't always know the size of images
+        return images.images[0]
+
+
+class CoverCache:
+    """
+    The cache is described by an index file (``index.json``), which stores
+    for each playlist the snapshot, url and hash of its cover, and for each
+    cover its size and last access time.
+
+    :param path: directory of the cache in the data directory
+    :param max_size: maximum size of the cached covers, in bytes
+    :param fetch: function returning the content of an url
+    """
+    def __init__(self, path=COVERS_DIR, max_size=MAX_CACHE_SIZE,
+                 fetch=download):
+        self.path = pathlib.Path(path)
+        self.max_size = max_size
+        self.fetch = fetch
+        self.playlists = {}
+        self.blobs = {}
+
+    @classmethod
+    def load(cls, *args, **kwargs):
+        cache = cls(*args, **kwargs)
+        index = festune.data.read_json(cache.path / "index.json")
+        if index is not None:
+            cache.playlists = index["playlists"]
+            cache.blobs = index["blobs"]
+
+        return cache
+
+    def save(self):
+        festune.data.write_file(self.path / "index.json", json.dumps({
+            "playlists": self.playlists, "blobs": self.blobs}))
+
+    @staticmethod
+    def _key(playlist):
+        return f"{playlist.user_id}:{playlist.object_id}"
+
+    def _blob_path(self, digest):
+        return self.path / "blobs" / digest[:2] / digest
+
+    @property
+    def size(self):
+        return sum(blob["size"] for blob in self.blobs.values())
+
+    def get(self, playlist):
+        """
+        Return the path of the cached cover of ``playlist``, or ``None``.
+
+        The access time of the cover is updated, it is stored on disk with
+        the index by :meth:`save()`.
+        """
+        entry = self.playlists.get(self._key(playlist))
+        if not entry or entry["hash"] not in self.blobs:
+            return None
+
+        self.blobs[entry["hash"]]["last_access"] = time.time()
+        return festune.data.get_filename(self._blob_path(entry["hash"]),
+                                         create_parent=False)
+
+    def is_fresh(self, playlist):
+        entry = self.playlists.get(self._key(playlist))
+        return bool(entry and entry["snapshot_id"] == playlist.snapshot_id
+                    and entry["hash"] in self.blobs)
+
+    def refresh(self, playlists, max_concurrency=MAX_CONCURRENT_DOWNLOADS):
+        """
+        Download the covers of ``playlists`` which are missing or outdated,
+        evict old covers if the cache is too big and save the index.
+
+        Return the number of downloaded covers.
+        """
+        to_fetch = {}
+        now = time.time()
+        for playlist in playlists:
+            if self.is_fresh(playlist):
+                # The cover is still used
+                digest = self.playlists[self._key(playlist)]["hash"]
+                self.blobs[digest]["last_access"] = now
+                continue
+
+            cover = pick_cover(playlist.images)
+            if cover:
+                to_fetch.setdefault(cover.url, []).append(playlist)
+
+        nb_downloaded = 0
+        with concurrent.futures.ThreadPoolExecutor(max_concurrency) as pool:
+            futures = {pool.submit(self.fetch, url): url for url in to_fetch}
+
+            for future in concurrent.futures.as_completed(futures):
+                url = futures[future]
+                try:
+                    digest = self._store(future.result())
+                except OSError as error:
+                    print(f"Failed to download {url}: {error}")
+                    continue
+
+                nb_downloaded += 1
+                for playlist in to_fetch[url]:
+                    self.playlists[self._key(playlist)] = {
+                        "snapshot_id": playlist.snapshot_id,
+                        "url": url,
+                        "hash": digest,
+                    }
+
+        self.evict()
+        self.save()
+        return nb_downloaded
+
+    def _store(self, content):
+        digest = hashlib.sha256(content).hexdigest()
+        if digest not in self.blobs:
+            path = festune.data.get_filename(self._blob_path(digest))
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as blob_file:
+                blob_file.write(content)
+
+            os.replace(tmp_path, path)
+
+        self.blobs[digest] = {"size": len(content), "last_access": time.time()}
+        return digest
+
+    def evict(self):
+        """
+        Remove covers until the cache fits in ``max_size``: covers which are
+        not the cover of a playlist anymore first, then the least recently
+        used covers.
+        """
+        size = self.size
+        used = {entry["hash"] for entry in self.playlists.values()}
+        by_last_access = sorted(self.blobs, key=lambda d: (
+            d in used, self.blobs[d]["last_access"]))
+
+        for digest in by_last_access:
+            if size <= self.max_size:
+                break
+
+            size -= self.blobs.pop(digest)["size"]
+            try:
+                os.unlink(festune.data.get_filename(
+                    self._blob_path(digest), create_parent=False))
+            except FileNotFoundError:
+                pass
+
+        self.playlists = {key: entry for key, entry in self.playlists.items()
+                          if entry["hash"] in self.blobs}
@@ -4,9 +4,18 @@ Store objects on disk.
 
 Note that the data model is not versioned and changes in code can make the data
 on disk unreadable.
+
+Files written with :func:`write_file()` (hence, all :class:`DataObject`) go
+through a journal: writes are grouped in batches, each batch is written and
+synced in the journal file before the files are replaced. If the process is
+interrupted, :func:`recover()` replays the last batch if it has been fully
+written in the journal or discards it, so files are never left truncated.
+Files removed with :func:`remove_file()` go through the same journal.
 """
+import atexit
 import dataclasses
 import functools
+import hashlib
 import inspect
 import json
 import os
@@ -18,6 +27,12 @@ import settings
 
 _DATA_DIR = pathlib.Path(settings.DATA_DIR)
 
+#: Name of the journal file in the data directory
+JOURNAL_FILE = "journal"
+
+#: Number of pending writes after which a batch is committed
+JOURNAL_BATCH_SIZE = 500
+
 
 def open_file(path, mode='r', **kwargs):
     """
@@ -29,6 +44,10 @@ def open_file(path, mode='r', **kwargs):
     Arguments are the same as the standard :meth:`open()`.
     """
     is_write_mode = mode[0] in "wax" or "+" in mode
+    if not is_write_mode:
+        # Pending writes must be visible
+        flush()
+
     path = get_filename(path, create_parent=is_write_mode)
     return open(path, mode, **kwargs)
 
@@ -50,6 +69,7 @@ def scan(path):
     """
     List the content of ``path``, which must be an existing directory.
     """
+    flush()
     path = _DATA_DIR / path
     return map(lambda p: p.relative_to(_DATA_DIR), path.iterdir())
 
@@ -60,6 +80,7 @@ def list_contents(path):
 
     If ``path`` doesn't exist, an empty iterable is returned.
     """
+    flush()
     path = _DATA_DIR / path
     try:
         for filename in path.iterdir():
@@ -69,6 +90,180 @@ def list_contents(path):
         yield from tuple()
 
 
+class Journal:
+    """
+    Group the writes of files in the data directory in batches.
+
+    A batch is committed when it contains ``batch_size`` files, or when
+    :meth:`commit()` is called. When committed, the batch is written in the
+    journal file, which is synced once, then each file is atomically replaced
+    by its new version. The journal is removed once all files are replaced
+    and synced.
+
+    If a file is written twice in a batch, only the last version is written.
+
+    :param path: path of the journal file in the data directory
+    :param batch_size: maximum number of files in a batch
+    """
+    def __init__(self, path=JOURNAL_FILE, batch_size=JOURNAL_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = {}
+
+    def write(self, path, content):
+        """
+        Add the file ``path`` with the text ``content`` to the batch.
+
+        If ``content`` is ``None``, the file is removed.
+        """
+        self.pending[str(path)] = content
+        if len(self.pending) >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        """
+        Write the pending batch on disk.
+        """
+        if not self.pending:
+            return
+
+        # A previous run may have been interrupted
+        self.recover()
+
+        entries = "".join(json.dumps(entry) + "\n"
+                          for entry in self.pending.items())
+        footer = json.dumps({
+            "entries": len(self.pending),
+            "sha256": hashlib.sha256(entries.encode("utf-8")).hexdigest(),
+        })
+
+        with open_file(self.path, "w") as journal_file:
+            journal_file.write(entries + footer + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+        self._apply(self.pending.items())
+        self.pending = {}
+
+    def recover(self):
+        """
+        Replay the batch found in the journal if it is complete, or discard
+        it.
+
+        Return ``True`` if a batch has been replayed.
+        """
+        journal_path = get_filename(self.path, create_parent=False)
+        try:
+            with open(journal_path, "r") as journal_file:
+                lines = journal_file.read().splitlines(keepends=True)
+        except FileNotFoundError:
+            return False
+
+        entries = self._parse(lines)
+        if entries is None:
+            os.unlink(journal_path)
+            return False
+
+        self._apply(entries)
+        return True
+
+    @staticmethod
+    def _parse(lines):
+        """
+        Return the entries of the journal, or ``None`` if the journal is
+        incomplete or corrupted.
+        """
+        if not lines:
+            return None
+
+        try:
+            footer = json.loads(lines[-1])
+            entries = "".join(lines[:-1])
+            digest = hashlib.sha256(entries.encode("utf-8")).hexdigest()
+
+            if (footer["entries"] != len(lines) - 1
+                    or footer["sha256"] != digest):
+                return None
+
+            return [json.loads(line) for line in lines[:-1]]
+        except (ValueError, TypeError, KeyError):
+            return None
+
+    def _apply(self, entries):
+        tmp_path = get_filename(f"{self.path}.tmp")
+        for path, content in entries:
+            if content is None:
+                try:
+                    os.unlink(get_filename(path, create_parent=False))
+                except FileNotFoundError:
+                    pass
+
+                continue
+
+            with open(tmp_path, "w") as tmp_file:
+                tmp_file.write(content)
+
+            os.replace(tmp_path, get_filename(path))
+
+        # The new files (and their directory entries) must be on disk before
+        # the journal is removed
+        os.sync()
+        os.unlink(get_filename(self.path, create_parent=False))
+
+
+_JOURNAL = Journal()
+
+
+def write_file(path, content):
+    """
+    Write the text ``content`` in the file ``path`` of the ``DATA_DIR``.
+
+    The write is journaled and may be delayed until the batch is committed,
+    see :class:`Journal`. Files read with :func:`open_file()`,
+    :func:`list_contents()` or :func:`scan()` always include pending writes.
+    """
+    _JOURNAL.write(path, content)
+
+
+def read_json(path, default=None):
+    """
+    Return the object stored in JSON in the file ``path`` of the ``DATA_DIR``,
+    or ``default`` if the file doesn't exist.
+    """
+    try:
+        with open_file(path, "r") as json_file:
+            return json.loads(json_file.read())
+    except FileNotFoundError:
+        return default
+
+
+def remove_file(path):
+    """
+    Remove the file ``path`` of the ``DATA_DIR``.
+
+    As :func:`write_file()`, the removal is journaled and may be delayed.
+    """
+    _JOURNAL.write(path, None)
+
+
+def flush():
+    """
+    Commit pending writes.
+    """
+    _JOURNAL.commit()
+
+
+def recover():
+    """
+    Replay or discard the batch of writes interrupted by a crash, see
+    :meth:`Journal.recover()`.
+    """
+    return _JOURNAL.recover()
+
+
+atexit.register(flush)
+
+
 class TypedObject:
     """
     An object which can be build from a json object.
@@ -157,8 +352,7 @@ class DataObject:
             serializable[field] = tuple(
                 tuple(item) for item in serializable[field].items())
 
-        with open_file(filename, "w") as data_file:
-            data_file.write(json.dumps(serializable))
+        write_file(filename, json.dumps(serializable))
 
     @classmethod
     def load_json(cls, json_str):
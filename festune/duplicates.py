@@ -0,0 +1,111 @@
+# coding: utf-8
+"""
+Find and remove the tracks present in several feston playlists.
+"""
+
+import festune.spotify
+
+
+#: Policies choosing which playlist keeps a duplicated track, among a list of
+#: feston playlists
+POLICIES = {
+    "oldest": min,
+    "newest": max,
+}
+
+
+def plan_removals(playlists, tracks, policy="oldest"):
+    """
+    Return the occurrences of duplicated tracks to remove, as a dict
+    {playlist: {position: track}}.
+
+    :param playlists: a :class:`festune.index.FestonPlaylistsIndex`
+    :param tracks: a :class:`festune.index.TracksIndex`
+    :param policy: name of the policy (see :data:`POLICIES`) choosing the
+                   playlist in which a track is kept
+    """
+    choose = POLICIES[policy]
+    removals = {}
+
+    for track in tracks:
+        if not track.object_id:
+            # Local files have no id, hence they all look like the same track
+            continue
+
+        in_playlists = [playlists.find_by_id(playlist)
+                        for playlist in tracks.playlists_of(track)
+                        if playlist in playlists]
+        if len(in_playlists) < 2:
+            continue
+
+        kept = choose(in_playlists)
+        for playlist in in_playlists:
+            if playlist is kept:
+                continue
+
+            position = track.position_in(playlist.user_id, playlist.object_id)
+            removals.setdefault(playlist, {})[position] = track
+
+    return removals
+
+
+def remove_occurrences(spotify, playlist, occurrences, tracks,
+                       changelog=None, history=None):
+    """
+    Remove the tracks at the given positions of ``playlist`` on the server,
+    then update the indexes from the snapshots returned by the server.
+
+    Positions are removed by chunks, from the end of the playlist so that the
+    positions of the next chunk are not changed by the previous one. Each
+    request is guarded by the snapshot returned by the previous one: if the
+    playlist has been modified meanwhile, the server rejects the request.
+
+    Return the number of removed tracks.
+
+    :param playlist: a :class:`festune.playlist.Playlist`, its ``snapshot_id``
+                     and ``nb_tracks`` are updated
+    :param occurrences: dict {position: track} of the tracks to remove
+    :param tracks: a :class:`festune.index.TracksIndex`
+    :param changelog: a :class:`festune.changelog.ChangeLog`, if set, the
+                      changes are logged
+    :param history: a :class:`festune.history.History`, if set, the new
+                    version of the playlist is recorded
+    """
+    positions = sorted(occurrences, reverse=True)
+    old_snapshot_id = playlist.snapshot_id
+    old_tracks = dict(tracks.tracks_of(playlist))
+    removed = []
+
+    try:
+        chunk_size = festune.spotify.MAX_TRACKS_PER_REQUEST
+        for i in range(0, len(positions), chunk_size):
+            chunk = positions[i:i + chunk_size]
+            result = (
+                spotify.user_playlist_remove_specific_occurrences_of_tracks(
+                    playlist.user_id, playlist.object_id,
+                    [{"uri": f"spotify:track:{occurrences[pos].object_id}",
+                      "positions": [pos]} for pos in chunk],
+                    snapshot_id=playlist.snapshot_id))
+
+            playlist.snapshot_id = result["snapshot_id"]
+            playlist.nb_tracks -= len(chunk)
+            removed.extend(chunk)
+    finally:
+        # If a request failed, the indexes must still reflect the previous
+        # ones
+        if removed:
+            tracks.remove_positions(playlist, removed)
+            playlist.save()
+
+            if changelog is not None:
+                changelog.append(playlist, old_snapshot_id,
+                                 playlist.snapshot_id, old_tracks,
+                                 dict(tracks.tracks_of(playlist)))
+
+            if history is not None:
+                history.record(playlist, [
+                    track.object_id for _, track
+                    in sorted(tracks.tracks_of(playlist).items())
+                    if track.object_id])
+
+    return len(removed)
@@ -0,0 +1,128 @@
+# coding: utf-8
+"""
+Audio features of the tracks (tempo, energy, key, danceability).
+
+Features are fetched with the bulk endpoint of the API and kept in a cache on
+disk, so each track is fetched only once.
+"""
+from typing import NamedTuple, Optional
+
+import concurrent.futures
+import json
+
+import festune.data
+import festune.spotify
+
+
+#: Name of the file storing the cache
+AUDIO_FEATURES_FILE = "audio-features.json"
+
+#: Maximum number of requests sent concurrently
+MAX_CONCURRENT_REQUESTS = 4
+
+
+class AudioFeatures(NamedTuple):
+    tempo: float
+    energy: float
+    key: int
+    danceability: float
+
+    @classmethod
+    def from_api(cls, features_json):
+        return cls(*(features_json[field] for field in cls._fields))
+
+
+class AudioFeaturesCache:
+    """
+    Audio features of tracks, by track id.
+
+    Tracks for which the API has no features are cached too, and
+    :meth:`get()` returns ``None`` for them.
+    """
+    def __init__(self, path=AUDIO_FEATURES_FILE):
+        self.path = path
+        self.features = {}
+
+    @classmethod
+    def load(cls, path=AUDIO_FEATURES_FILE):
+        cache = cls(path)
+        cache.features = {
+            track_id: AudioFeatures(*features) if features else None
+            for track_id, features
+            in festune.data.read_json(path, {}).items()}
+
+        return cache
+
+    def save(self):
+        festune.data.write_file(self.path, json.dumps(self.features))
+
+    def __contains__(self, track):
+        return track.object_id in self.features
+
+    def __len__(self):
+        return len(self.features)
+
+    def get(self, track) -> Optional[AudioFeatures]:
+        return self.features.get(track.object_id)
+
+    def missing(self, tracks):
+        """
+        Return the ids of the tracks of the iterable ``tracks`` which are not
+        in the cache.
+        """
+        return list(dict.fromkeys(
+            track.object_id for track in tracks
+            if track.object_id and track not in self))
+
+    def enrich(self, spotify, tracks,
+               max_concurrency=MAX_CONCURRENT_REQUESTS):
+        """
+        Fetch the features of the tracks which are not in the cache yet, and
+        save the cache.
+
+        A request which fails doesn't prevent the others from being saved, its
+        tracks will be fetched again by the next call.
+
+        Return the tuple (number of fetched tracks, list of the errors of the
+        failed requests).
+
+        :param spotify: spotify api client
+        :param tracks: iterable of :class:`festune.playlist.PlaylistTrack`
+        :param max_concurrency: maximum number of requests sent concurrently
+        """
+        import spotipy
+
+        track_ids = self.missing(tracks)
+        if not track_ids:
+            return 0, []
+
+        chunk_size = festune.spotify.MAX_TRACKS_PER_REQUEST
+        chunks = [track_ids[i:i + chunk_size]
+                  for i in range(0, len(track_ids), chunk_size)]
+
+        nb_fetched = 0
+        errors = []
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_concurrency) as pool:
+                futures = [pool.submit(spotify.audio_features, chunk)
+                           for chunk in chunks]
+
+                for chunk, future in zip(chunks, futures):
+                    try:
+                        features = future.result()
+                    except spotipy.SpotifyException as exc:
+                        errors.append(exc)
+                        continue
+
+                    for track_id, track_features in zip(chunk,
+                                                        features or ()):
+                        self.features[track_id] = (
+                            AudioFeatures.from_api(track_features)
+                            if track_features else None)
+
+                    nb_fetched += len(chunk)
+        finally:
+            self.save()
+
+        return nb_fetched, errors
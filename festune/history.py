@@ -0,0 +1,163 @@
+# coding: utf-8
+"""
+History of the versions of the playlists.
+
+Each time a new snapshot of a playlist is seen, the list of its tracks is
+recorded. A version is stored as the delta from the previous version (the
+slices of the list replaced by other tracks), except one version every
+:data:`KEYFRAME_INTERVAL` which is stored in full: a version is rebuilt from
+the last full version before it and the following deltas.
+"""
+import bisect
+import difflib
+import json
+import pathlib
+import time
+
+import festune.data
+import festune.playlist
+
+
+#: Directory storing the history, one file per playlist
+HISTORY_DIR = pathlib.Path("history")
+
+#: A version out of ``KEYFRAME_INTERVAL`` is stored in full
+KEYFRAME_INTERVAL = 64
+
+
+def compute_delta(old_tracks, new_tracks):
+    """
+    Return the delta transforming the list ``old_tracks`` in ``new_tracks``:
+    a list of ``[start, end, tracks]``, meaning that ``old_tracks[start:end]``
+    is replaced by ``tracks``.
+    """
+    matcher = difflib.SequenceMatcher(None, old_tracks, new_tracks,
+                                      autojunk=False)
+    return [[i1, i2, new_tracks[j1:j2]]
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+            if tag != "equal"]
+
+
+def apply_delta(tracks, delta):
+    """
+    Return the list ``tracks`` transformed by ``delta``, see
+    :func:`compute_delta()`.
+    """
+    tracks = list(tracks)
+    # Slices are replaced from the end so that positions remain valid
+    for start, end, replacement in reversed(delta):
+        tracks[start:end] = replacement
+
+    return tracks
+
+
+class PlaylistHistory:
+    """
+    The versions of a playlist, each version has a ``snapshot_id``, a
+    ``time`` (timestamp at which it has been recorded) and either the list of
+    its ``tracks`` or the ``delta`` from the previous version.
+    """
+    def __init__(self, user_id, playlist_id):
+        self.user_id = user_id
+        self.playlist_id = playlist_id
+        self.versions = []
+        self._last_tracks = None
+
+    @property
+    def path(self):
+        return HISTORY_DIR / f"{self.user_id}-{self.playlist_id}.json"
+
+    @classmethod
+    def load(cls, user_id, playlist_id):
+        history = cls(user_id, playlist_id)
+        history.versions = festune.data.read_json(history.path, [])
+        return history
+
+    def save(self):
+        festune.data.write_file(self.path, json.dumps(self.versions))
+
+    def record(self, snapshot_id, track_ids, timestamp=None):
+        """
+        Add a version of the playlist.
+
+        Return ``False`` if the version is the same as the last one.
+        """
+        if self.versions and self.versions[-1]["snapshot_id"] == snapshot_id:
+            return False
+
+        timestamp = time.time() if timestamp is None else timestamp
+        if self.versions:
+            # Versions must stay sorted, even if the clock goes backwards
+            timestamp = max(timestamp, self.versions[-1]["time"])
+
+        track_ids = list(track_ids)
+        version = {"snapshot_id": snapshot_id, "time": timestamp}
+        if len(self.versions) % KEYFRAME_INTERVAL == 0:
+            version["tracks"] = track_ids
+        else:
+            if self._last_tracks is None:
+                self._last_tracks = self.tracks_of(len(self.versions) - 1)
+
+            version["delta"] = compute_delta(self._last_tracks, track_ids)
+
+        self.versions.append(version)
+        self._last_tracks = track_ids
+        return True
+
+    def find_version(self, timestamp):
+        """
+        Return the index of the version of the playlist at ``timestamp``, or
+        ``None`` if the playlist was not known yet.
+        """
+        times = [version["time"] for version in self.versions]
+        index = bisect.bisect_right(times, timestamp) - 1
+        return index if index >= 0 else None
+
+    def tracks_of(self, index):
+        """
+        Return the list of track ids of the version at ``index``.
+        """
+        keyframe = index - index % KEYFRAME_INTERVAL
+        tracks = self.versions[keyframe]["tracks"]
+        for version in self.versions[keyframe + 1:index + 1]:
+            tracks = apply_delta(tracks, version["delta"])
+
+        return list(tracks)
+
+    def at(self, timestamp):
+        """
+        Return the list of the track ids of the playlist at ``timestamp``, or
+        ``None`` if the playlist was not known yet.
+        """
+        index = self.find_version(timestamp)
+        return self.tracks_of(index) if index is not None else None
+
+
+class History:
+    """
+    Histories of all playlists, loaded when needed.
+    """
+    def __init__(self):
+        self.playlists = {}
+
+    def of(self, user_id, playlist_id=None):
+        """
+        Return the :class:`PlaylistHistory` of the playlist, which is either
+        given as a :class:`festune.playlist.Playlist` or as ids.
+        """
+        if isinstance(user_id, festune.playlist.Playlist):
+            user_id, playlist_id = user_id.user_id, user_id.object_id
+
+        key = (user_id, playlist_id)
+        if key not in self.playlists:
+            self.playlists[key] = PlaylistHistory.load(*key)
+
+        return self.playlists[key]
+
+    def record(self, playlist, track_ids, timestamp=None):
+        """
+        Record the tracks of the current snapshot of ``playlist``.
+        """
+        history = self.of(playlist)
+        if history.record(playlist.snapshot_id, track_ids, timestamp):
+            history.save()
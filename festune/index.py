@@ -1,7 +1,10 @@
 # coding: utf-8
+import bisect
 import collections
 
+import festune.bitmap
 import festune.playlist
+import festune.search
 
 
 class PlaylistsIndex:
@@ -87,11 +90,23 @@ class FestonPlaylistsIndex(PlaylistsIndex):
 class TracksIndex:
     """
     Custom set of tracks, allows to detect duplicates.
+
+    Each track gets a dense id (its rank of insertion in the index), the
+    membership of the tracks of a playlist is also stored as a bitmap of these
+    ids, see :meth:`bitmap_of()`.
+
+    Tracks are also indexed in a :class:`festune.search.SearchIndex`
+    (``search_index``), a track is removed from it when it's not in any
+    playlist anymore.
     """
-    def __init__(self):
+    def __init__(self, search_index=None):
         self.tracks = {}
         self.in_playlists = collections.defaultdict(set)
         self.tracks_of_playlist = collections.defaultdict(dict)
+        self.dense_ids = {}
+        self.by_dense_id = []
+        self.bitmaps = collections.defaultdict(festune.bitmap.Bitmap)
+        self.search_index = search_index or festune.search.SearchIndex()
 
     def add(self, track):
         """
@@ -106,11 +121,23 @@ class TracksIndex:
         # If we knew about this track, ensure it knows about all playlists
         if track_in_index is not track:
             track_in_index.playlists.update(track.playlists)
+        else:
+            self.dense_ids[track_hash] = len(self.by_dense_id)
+            self.by_dense_id.append(track)
+
+        # Tracks which are not in any playlist are not searchable (the index
+        # loaded from the disk may still know them)
+        if track_in_index.playlists:
+            self.search_index.add(track_in_index)
+        else:
+            self.search_index.remove(track_in_index)
 
         self.in_playlists[track_hash].update(track.playlist_ids)
 
+        dense_id = self.dense_ids[track_hash]
         for playlist, position in track.playlists.items():
             self.tracks_of_playlist[playlist][position] = track
+            self.bitmaps[playlist].add(dense_id)
 
         track_in_index.save()
         return track_in_index
@@ -143,17 +170,108 @@ class TracksIndex:
             playlist = (playlist.user_id, playlist.object_id)
 
         track_hash = hash(track)
-        track = self.tracks.setdefault(track_hash, track)
+        if track_hash not in self.tracks:
+            track = self.add(track)
+        else:
+            track = self.tracks[track_hash]
+
         self.in_playlists[track_hash].discard(playlist)
         track.playlists.pop(playlist, None)
+        self.bitmaps[playlist].discard(self.dense_ids[track_hash])
 
         self.tracks_of_playlist[playlist] = dict(
             (pos, t) for (pos, t) in self.tracks_of_playlist[playlist].items()
-            if hash(t) == hash(track))
+            if hash(t) != track_hash)
+
+        if not track.playlists:
+            self.search_index.remove(track)
 
         track.save()
         return track
 
+    def remove_positions(self, playlist, positions):
+        """
+        Remove the tracks at ``positions`` from ``playlist`` and shift the
+        positions of the following tracks, as the server does when tracks are
+        removed from a playlist.
+        """
+        if isinstance(playlist, festune.playlist.Playlist):
+            playlist = (playlist.user_id, playlist.object_id)
+
+        positions = sorted(set(positions))
+        old_tracks = self.tracks_of_playlist.get(playlist, {})
+
+        for position in positions:
+            if position in old_tracks:
+                self.remove_track_from(old_tracks[position], playlist)
+
+        new_tracks = {}
+        for position, track in old_tracks.items():
+            if position in positions:
+                continue
+
+            new_position = position - bisect.bisect_left(positions, position)
+            track_in_index = self.tracks[hash(track)]
+            new_tracks[new_position] = track_in_index
+
+            if new_position != position:
+                track_in_index.playlists[playlist] = new_position
+                track_in_index.save()
+
+        self.tracks_of_playlist[playlist] = new_tracks
+
+    def orphans(self):
+        """
+        Returns the tracks which are not in any playlist anymore.
+        """
+        return [track for track in self.tracks.values()
+                if not track.playlists]
+
+    def discard_all(self, tracks):
+        """
+        Remove ``tracks`` from the index (but not from the disk).
+
+        Dense ids are given again to the remaining tracks, so that they stay
+        dense, and the bitmaps are built again.
+        """
+        for track in tracks:
+            track_hash = hash(track)
+            if self.tracks.pop(track_hash, None) is None:
+                continue
+
+            self.in_playlists.pop(track_hash, None)
+            self.search_index.remove(track)
+
+        self.by_dense_id = [track for track in self.by_dense_id
+                            if hash(track) in self.tracks]
+        self.dense_ids = {hash(track): dense_id
+                          for dense_id, track in enumerate(self.by_dense_id)}
+
+        self.bitmaps = collections.defaultdict(festune.bitmap.Bitmap)
+        for dense_id, track in enumerate(self.by_dense_id):
+            for playlist in track.playlists:
+                self.bitmaps[playlist].add(dense_id)
+
+    def bitmap_of(self, playlist):
+        """
+        Returns the :class:`festune.bitmap.Bitmap` of the dense ids of the
+        tracks in the given playlist.
+        """
+        if isinstance(playlist, festune.playlist.Playlist):
+            playlist = (playlist.user_id, playlist.object_id)
+
+        return self.bitmaps.get(playlist, festune.bitmap.Bitmap())
+
+    def find_by_id(self, object_id, object_type="track"):
+        # Same hash as festune.playlist.PlaylistTrack
+        return self.tracks[hash((object_type, object_id))]
+
+    def dense_id_of(self, track):
+        return self.dense_ids[hash(track)]
+
+    def find_by_dense_id(self, dense_id):
+        return self.by_dense_id[dense_id]
+
     def __iter__(self):
         return iter(self.tracks.values())
 
@@ -164,29 +282,51 @@ class TracksIndex:
         return hash(track) in self.tracks
 
 
-def refresh_indexes(spotify, playlists, tracks):
+def refresh_indexes(spotify, playlists, tracks, changelog=None,
+                    history=None):
     """
     Refresh the indexes from the server: update playlists and tracks, and
     return a dict {playlist_id: set of tracks in the  playlist}.
+
+    If ``changelog`` is a :class:`festune.changelog.ChangeLog`, the changes of
+    each refreshed playlist are appended to it.
+
+    If ``history`` is a :class:`festune.history.History`, the new version of
+    each refreshed playlist is recorded in it.
     """
     refreshed_tracks = {}
     for playlist in playlists.get_playlists_to_refresh(spotify):
         print(f"Refreshing {playlist.name}")
+        old_snapshot_id = None
+        if playlist in playlists:
+            old_snapshot_id = playlists.find(playlist).snapshot_id
+
         playlists.add(playlist)
 
-        old_tracks = tracks.tracks_of(playlist)
+        old_tracks = dict(tracks.tracks_of(playlist))
 
-        new_tracks = festune.playlist.PlaylistTrack.load_from_server(
-            spotify, playlist)
+        new_tracks = list(festune.playlist.PlaylistTrack.load_from_server(
+            spotify, playlist))
 
         if old_tracks:
-            new_tracks = list(new_tracks)
             new_track_hashes = set(map(hash, new_tracks))
 
             for track in old_tracks.values():
                 if hash(track) not in new_track_hashes:
                     tracks.remove_track_from(track, playlist)
 
+            # Positions of the remaining tracks are set again by add_all()
+            tracks.tracks_of_playlist.pop(
+                (playlist.user_id, playlist.object_id), None)
+
         refreshed_tracks[playlist] = tracks.add_all(new_tracks)
 
+        if changelog is not None:
+            changelog.append(playlist, old_snapshot_id, playlist.snapshot_id,
+                             old_tracks, dict(enumerate(new_tracks)))
+
+        if history is not None:
+            history.record(playlist, [track.object_id for track in new_tracks
+                                      if track.object_id])
+
     return refreshed_tracks
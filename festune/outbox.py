@@ -0,0 +1,183 @@
+# coding: utf-8
+"""
+Durable queue of the changes to send to playlists on the server.
+
+Writes to playlists are not sent directly: they are queued in the outbox,
+which is stored on disk, and sent by :meth:`Outbox.drain()`. If a request
+fails (network error, expired token, ...), the operation stays in the outbox
+and is sent again by the next run.
+
+Operations of a playlist are coalesced when they are queued: a replace
+supersedes all the previous operations of the playlist, and tracks added or
+removed after a replace are merged in it. Consecutive additions (or removals)
+are merged too.
+"""
+import json
+import time
+
+import festune.data
+import festune.spotify
+
+
+#: Name of the file storing the outbox
+OUTBOX_FILE = "outbox.json"
+
+#: Number of attempts of an operation in a call to :meth:`Outbox.drain()`
+MAX_ATTEMPTS = 3
+
+#: Delay before the first retry, in seconds, doubled after each attempt
+RETRY_DELAY = 1
+
+
+class Outbox:
+    """
+    Pending operations, by playlist.
+
+    An operation is a dict with the keys ``kind`` ("replace", "add" or
+    "remove") and ``tracks`` (list of track ids).
+    """
+    def __init__(self, path=OUTBOX_FILE):
+        self.path = path
+        #: "user_id:playlist_id" => list of operations
+        self.operations = {}
+
+    @classmethod
+    def load(cls, path=OUTBOX_FILE):
+        outbox = cls(path)
+        outbox.operations = festune.data.read_json(path, {})
+        return outbox
+
+    def save(self):
+        festune.data.write_file(self.path, json.dumps(self.operations))
+        # Operations must not be lost if the process is interrupted
+        festune.data.flush()
+
+    def __len__(self):
+        return sum(map(len, self.operations.values()))
+
+    @staticmethod
+    def _key(user_id, playlist_id):
+        return f"{user_id}:{playlist_id}"
+
+    def pending(self, user_id, playlist_id):
+        return self.operations.get(self._key(user_id, playlist_id), [])
+
+    def replace(self, user_id, playlist_id, tracks):
+        """
+        Queue the replacement of the tracks of the playlist.
+        """
+        self.operations[self._key(user_id, playlist_id)] = [
+            {"kind": "replace", "tracks": list(tracks)}]
+        self.save()
+
+    def add(self, user_id, playlist_id, tracks):
+        """
+        Queue the addition of ``tracks`` at the end of the playlist.
+        """
+        tracks = list(tracks)
+        if not tracks:
+            return
+
+        queue = self.operations.setdefault(
+            self._key(user_id, playlist_id), [])
+        if queue and queue[-1]["kind"] in ("replace", "add"):
+            queue[-1]["tracks"].extend(tracks)
+        else:
+            queue.append({"kind": "add", "tracks": tracks})
+
+        self.save()
+
+    def remove(self, user_id, playlist_id, tracks):
+        """
+        Queue the removal of all the occurrences of ``tracks`` from the
+        playlist.
+        """
+        tracks = list(tracks)
+        if not tracks:
+            return
+
+        queue = self.operations.setdefault(
+            self._key(user_id, playlist_id), [])
+        removed = set(tracks)
+
+        if queue and queue[-1]["kind"] in ("replace", "add"):
+            queue[-1]["tracks"] = [track for track in queue[-1]["tracks"]
+                                   if track not in removed]
+
+        if queue and queue[-1]["kind"] == "replace":
+            # The replace already gives the final state of the playlist
+            pass
+        elif queue and queue[-1]["kind"] == "remove":
+            queue[-1]["tracks"].extend(
+                track for track in tracks
+                if track not in queue[-1]["tracks"])
+        else:
+            queue.append({"kind": "remove", "tracks": tracks})
+
+        self.save()
+
+    def _send(self, spotify, user_id, playlist_id, operation):
+        """
+        Send ``operation`` by chunks. The operation is updated (and saved)
+        after each chunk, so that a chunk is not sent twice.
+        """
+        while True:
+            chunk = operation["tracks"][
+                :festune.spotify.MAX_TRACKS_PER_REQUEST]
+
+            if operation["kind"] == "replace":
+                spotify.user_playlist_replace_tracks(
+                    user_id, playlist_id, chunk)
+                # The rest of the tracks must be added
+                operation["kind"] = "add"
+            elif operation["kind"] == "add" and chunk:
+                spotify.user_playlist_add_tracks(user_id, playlist_id, chunk)
+            elif operation["kind"] == "remove" and chunk:
+                spotify.user_playlist_remove_all_occurrences_of_tracks(
+                    user_id, playlist_id, chunk)
+
+            del operation["tracks"][:len(chunk)]
+            if not operation["tracks"]:
+                return
+
+            self.save()
+
+    def drain(self, spotify, max_attempts=MAX_ATTEMPTS,
+              retry_delay=RETRY_DELAY):
+        """
+        Send the pending operations, in order, for each playlist.
+
+        An operation is tried up to ``max_attempts`` times. If it still
+        fails, the next operations of the same playlist are kept in the
+        outbox, other playlists are still updated.
+
+        Return the number of operations sent.
+        """
+        nb_sent = 0
+        for key in list(self.operations):
+            user_id, playlist_id = key.split(":", 1)
+            queue = self.operations[key]
+
+            while queue:
+                for attempt in range(max_attempts):
+                    try:
+                        self._send(spotify, user_id, playlist_id, queue[0])
+                        break
+                    except Exception as exc:  # noqa
+                        print(f"Failed to update playlist {playlist_id} "
+                              f"(attempt {attempt + 1}): {exc}")
+
+                        if attempt + 1 < max_attempts:
+                            time.sleep(retry_delay * 2 ** attempt)
+                else:
+                    break
+
+                queue.pop(0)
+                nb_sent += 1
+                self.save()
+
+            if not queue:
+                del self.operations[key]
+
+        self.save()
+        return nb_sent
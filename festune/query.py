@@ -0,0 +1,197 @@
+# coding: utf-8
+"""
+Set algebra on the tracks of the feston playlists.
+
+An expression combines sets of tracks with the operators ``|`` (union), ``&``
+(intersection) and ``-`` (difference). ``&`` has precedence over ``|`` and
+``-``, parentheses can be used to group terms. Operands are:
+
+* a month: ``2023-03``, the tracks of the feston playlist of this month,
+* a year: ``2023``, the tracks of all the feston playlists of this year,
+* a range: ``2022-11..2023-02`` or ``2021..2022``, bounds included,
+* a playlist name between double quotes,
+* ``all``: the tracks of all the feston playlists,
+* ``once``: the tracks which are in exactly one feston playlist.
+
+For instance, "tracks in any 2022 playlist but none from 2023" is
+``2022 - 2023``.
+
+Expressions are evaluated on the bitmaps of :class:`festune.index.TracksIndex`.
+"""
+import re
+
+import festune.bitmap
+import festune.exceptions
+
+
+_TOKEN_REGEX = re.compile(r"""
+    \s*(?:
+        (?P<range>(?P<start>\d{4}(?:-\d{1,2}(?!\d))?)
+                  (?:\.\.(?P<end>\d{4}(?:-\d{1,2}(?!\d))?))?)
+        | "(?P<name>[^"]*)"
+        | (?P<keyword>[a-z]+)
+        | (?P<operator>[()&|-])
+    )""", re.VERBOSE)
+
+_KEYWORDS = frozenset(("all", "once"))
+
+
+class Error(festune.exceptions.Error):
+    pass
+
+
+def _parse_date(date, is_end):
+    """
+    Return the (year, month) tuple of a date written as ``YYYY`` or
+    ``YYYY-MM``. If the month is missing, it is the first or last month of
+    the year if ``is_end`` is ``True``.
+    """
+    year, _, month = date.partition("-")
+    if not month:
+        return int(year), 12 if is_end else 1
+
+    if not 1 <= int(month) <= 12:
+        raise Error(f"Invalid month in {date}")
+
+    return int(year), int(month)
+
+
+def tokenize(expression):
+    """
+    Split ``expression`` in a list of tokens, which are tuples
+    ``(kind, value)``.
+    """
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+
+    while position < len(expression):
+        match = _TOKEN_REGEX.match(expression, position)
+        if not match:
+            raise Error(f"Unexpected character at position {position} in "
+                        f"{expression!r}")
+
+        if match.group("range"):
+            start = match.group("start")
+            end = match.group("end") or start
+            tokens.append(("range", (_parse_date(start, False),
+                                     _parse_date(end, True))))
+        elif match.group("name") is not None:
+            tokens.append(("name", match.group("name")))
+        elif match.group("keyword"):
+            if match.group("keyword") not in _KEYWORDS:
+                raise Error(f"Unknown keyword {match.group('keyword')}")
+            tokens.append(("keyword", match.group("keyword")))
+        else:
+            tokens.append(("operator", match.group("operator")))
+
+        position = match.end()
+
+    return tokens
+
+
+class Query:
+    """
+    Evaluate expressions on the indexes.
+
+    :param playlists: a :class:`festune.index.FestonPlaylistsIndex`
+    :param tracks: a :class:`festune.index.TracksIndex`
+    """
+    def __init__(self, playlists, tracks):
+        self.playlists = playlists
+        self.tracks = tracks
+
+    def evaluate(self, expression):
+        """
+        Return the :class:`festune.bitmap.Bitmap` of the dense ids of the
+        tracks matching ``expression``.
+        """
+        tokens = tokenize(expression)
+        if not tokens:
+            raise Error("Empty expression")
+
+        bits, position = self._parse_expression(tokens, 0)
+        if position != len(tokens):
+            raise Error(f"Unexpected {tokens[position][1]!r} in "
+                        f"{expression!r}")
+
+        return festune.bitmap.Bitmap.from_int(bits)
+
+    def find(self, expression):
+        """
+        Return the list of tracks matching ``expression``.
+        """
+        return [self.tracks.find_by_dense_id(dense_id)
+                for dense_id in self.evaluate(expression)]
+
+    # The parser works on integers rather than on bitmaps to avoid conversions
+    # between each operation.
+    def _parse_expression(self, tokens, position):
+        bits, position = self._parse_term(tokens, position)
+
+        while position < len(tokens) and tokens[position][1] in ("|", "-"):
+            operator = tokens[position][1]
+            other, position = self._parse_term(tokens, position + 1)
+            bits = bits | other if operator == "|" else bits & ~other
+
+        return bits, position
+
+    def _parse_term(self, tokens, position):
+        bits, position = self._parse_factor(tokens, position)
+
+        while position < len(tokens) and tokens[position][1] == "&":
+            other, position = self._parse_factor(tokens, position + 1)
+            bits &= other
+
+        return bits, position
+
+    def _parse_factor(self, tokens, position):
+        if position >= len(tokens):
+            raise Error("Unexpected end of expression")
+
+        kind, value = tokens[position]
+        if kind == "operator":
+            if value != "(":
+                raise Error(f"Unexpected {value!r}")
+
+            bits, position = self._parse_expression(tokens, position + 1)
+            if position >= len(tokens) or tokens[position][1] != ")":
+                raise Error("Missing closing parenthesis")
+
+            return bits, position + 1
+
+        return self._operand(kind, value), position + 1
+
+    def _operand(self, kind, value):
+        if kind == "range":
+            start, end = value
+            return self._union(playlist for date, playlist
+                               in self.playlists.by_date.items()
+                               if start <= date <= end)
+
+        if kind == "name":
+            matching = [playlist for playlist in self.playlists
+                        if playlist.name == value]
+            if not matching:
+                raise Error(f"Unknown playlist {value!r}")
+
+            return self._union(matching)
+
+        if value == "all":
+            return self._union(self.playlists)
+
+        # once: tracks seen in exactly one playlist
+        seen = several = 0
+        for playlist in self.playlists:
+            bits = self.tracks.bitmap_of(playlist).to_int()
+            several |= seen & bits
+            seen |= bits
+
+        return seen & ~several
+
+    def _union(self, playlists):
+        bits = 0
+        for playlist in playlists:
+            bits |= self.tracks.bitmap_of(playlist).to_int()
+
+        return bits
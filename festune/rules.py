@@ -0,0 +1,448 @@
+# coding: utf-8
+"""
+Smart playlists: playlists whose tracks are selected by a rule.
+
+A rule is declared in the settings (see ``SMART_PLAYLISTS`` in
+``settings_dist.py``), for instance "tracks of the feston playlists of the last
+60 days, not in a playlist with 'spéciale' in its name, at most 2 per
+artist"::
+
+    {
+        "name": "recent",
+        "playlist": ("user_id", "playlist_id"),
+        "within_days": 60,
+        "exclude": ["spéciale"],
+        "max_per_artist": 2,
+    }
+
+Rules are evaluated incrementally: the tracks matching the rule are stored
+with the cursor of the last change read in the change log
+(:mod:`festune.changelog`), the next evaluation only checks the tracks which
+changed since. Only the tracks to add and to remove are then queued in the
+outbox (:mod:`festune.outbox`).
+
+Exclusions apply to all the playlists of the user: the tracks of the playlists
+which are not feston playlists (hence not in the indexes) but are excluded by
+a rule are stored by :class:`ExcludedPlaylists`.
+"""
+from typing import Dict, Optional, Sequence, Tuple
+
+import calendar
+import dataclasses
+import datetime
+import hashlib
+import json
+import pathlib
+
+import festune.changelog
+import festune.data
+import festune.playlist
+
+
+#: Directory storing the state of smart playlists
+SMART_PLAYLISTS_DIR = pathlib.Path("smart-playlists")
+
+#: Name of the file storing the tracks of the excluded playlists
+EXCLUDED_PLAYLISTS_FILE = SMART_PLAYLISTS_DIR / "excluded-playlists.json"
+
+
+@dataclasses.dataclass
+class Rule:
+    #: Name of the rule, used to store its state
+    name: str
+    #: (user_id, playlist_id) of the smart playlist
+    playlist: Tuple[str, str]
+    #: Only consider feston playlists of months ending less than
+    #: ``within_days`` days ago
+    within_days: Optional[int] = None
+    #: Only consider playlists with this text in their name
+    include: Optional[str] = None
+    #: Exclude tracks in any playlist (feston or not) with one of these texts
+    #: in their name
+    exclude: Sequence[str] = ()
+    #: Audio features ranges, {feature: (min, max)}, see
+    #: :class:`festune.features.AudioFeatures`
+    features: Dict[str, Tuple[float, float]] = dataclasses.field(
+        default_factory=dict)
+    #: Maximum number of tracks of an artist (first artist of the track)
+    max_per_artist: Optional[int] = None
+    #: Maximum number of tracks in the playlist
+    limit: Optional[int] = None
+
+    def __post_init__(self):
+        self.playlist = tuple(self.playlist)
+
+    @property
+    def digest(self):
+        """
+        Changes when the definition of the rule changes.
+        """
+        definition = json.dumps(dataclasses.asdict(self), sort_keys=True)
+        return hashlib.sha1(definition.encode("utf-8")).hexdigest()
+
+
+class ExcludedPlaylists:
+    """
+    Tracks of the playlists which are not feston playlists, and have one of
+    the texts excluded by rules in their name.
+    """
+    def __init__(self, path=EXCLUDED_PLAYLISTS_FILE):
+        self.path = path
+        #: "user_id:playlist_id" => {"name", "snapshot_id", "tracks"}
+        self.playlists = {}
+
+    @classmethod
+    def load(cls, path=EXCLUDED_PLAYLISTS_FILE):
+        excluded = cls(path)
+        excluded.playlists = festune.data.read_json(path, {})
+        return excluded
+
+    def save(self):
+        festune.data.write_file(self.path, json.dumps(self.playlists))
+
+    def refresh(self, spotify, texts):
+        """
+        Update the playlists with one of ``texts`` in their name, the tracks
+        of a playlist are downloaded again when its snapshot changed.
+
+        Return the number of downloaded playlists.
+        """
+        playlists = {}
+        nb_downloaded = 0
+        for playlist in (festune.playlist.Playlist.load_all_from_server(
+                spotify) if texts else ()):
+            if (festune.playlist.FestonPlaylist.is_feston(playlist.name)
+                    or not any(text in playlist.name for text in texts)):
+                continue
+
+            key = f"{playlist.user_id}:{playlist.object_id}"
+            entry = self.playlists.get(key)
+            if not entry or entry["snapshot_id"] != playlist.snapshot_id:
+                items = spotify.user_playlist_tracks(
+                    playlist.user_id, playlist.object_id).paginate()
+                entry = {
+                    "name": playlist.name,
+                    "snapshot_id": playlist.snapshot_id,
+                    # Local files and episodes are ignored
+                    "tracks": [item["track"]["id"] for item in items
+                               if item.get("track")
+                               and item["track"].get("id")],
+                }
+                nb_downloaded += 1
+
+            playlists[key] = entry
+
+        self.playlists = playlists
+        self.save()
+        return nb_downloaded
+
+    def matching(self, texts):
+        """
+        Return the keys of the playlists with one of ``texts`` in their name.
+        """
+        return sorted(key for key, entry in self.playlists.items()
+                      if any(text in entry["name"] for text in texts))
+
+    def version(self, texts):
+        """
+        Return the sorted list of the snapshots of the playlists with one of
+        ``texts`` in their name, it changes when one of them changes.
+        """
+        return [f"{key}:{self.playlists[key]['snapshot_id']}"
+                for key in self.matching(texts)]
+
+    def tracks_of(self, texts):
+        """
+        Return the set of the ids of the tracks of the playlists with one of
+        ``texts`` in their name.
+        """
+        return {track_id for key in self.matching(texts)
+                for track_id in self.playlists[key]["tracks"]}
+
+
+def _month_end(playlist):
+    last_day = calendar.monthrange(playlist.year, playlist.month)[1]
+    return datetime.date(playlist.year, playlist.month, last_day)
+
+
+class SmartPlaylist:
+    """
+    Evaluate a :class:`Rule` and update its playlist.
+
+    The state (``candidates`` matching the rule, ``pushed`` tracks of the
+    playlist and ``cursor`` in the change log) is stored in the data
+    directory.
+    """
+    def __init__(self, rule):
+        self.rule = rule
+        self.digest = None
+        self.cursor = 0
+        self.window = []
+        #: Snapshots of the excluded playlists, see
+        #: :meth:`ExcludedPlaylists.version()`
+        self.excluded = []
+        self.candidates = set()
+        #: Tracks checked before their audio features were known, they are
+        #: checked again by the next evaluation
+        self.missing_features = set()
+        #: ``None`` until the playlist is pushed for the first time
+        self.pushed = None
+
+    @property
+    def path(self):
+        return SMART_PLAYLISTS_DIR / f"{self.rule.name}.json"
+
+    @property
+    def consumer(self):
+        """
+        Name of the smart playlist as a consumer of the change log.
+        """
+        return f"smart-playlist:{self.rule.name}"
+
+    @classmethod
+    def load(cls, rule):
+        smart_playlist = cls(rule)
+        state = festune.data.read_json(smart_playlist.path)
+        if state is None:
+            return smart_playlist
+
+        smart_playlist.digest = state["digest"]
+        smart_playlist.cursor = state["cursor"]
+        smart_playlist.window = state["window"]
+        smart_playlist.excluded = state["excluded"]
+        smart_playlist.candidates = set(state["candidates"])
+        smart_playlist.missing_features = set(state["missing_features"])
+        smart_playlist.pushed = state["pushed"]
+        return smart_playlist
+
+    def save(self):
+        festune.data.write_file(self.path, json.dumps({
+            "digest": self.digest,
+            "cursor": self.cursor,
+            "window": self.window,
+            "excluded": self.excluded,
+            "candidates": sorted(self.candidates),
+            "missing_features": sorted(self.missing_features),
+            "pushed": self.pushed,
+        }))
+
+    def get_window(self, playlists, today=None):
+        """
+        Return the sorted list of the keys of the playlists considered by the
+        rule.
+        """
+        rule = self.rule
+        if rule.within_days is not None:
+            start = ((today or datetime.date.today())
+                     - datetime.timedelta(days=rule.within_days))
+
+        window = []
+        for playlist in playlists:
+            if rule.include and rule.include not in playlist.name:
+                continue
+
+            if rule.within_days is not None and _month_end(playlist) < start:
+                continue
+
+            window.append(f"{playlist.user_id}:{playlist.object_id}")
+
+        return sorted(window)
+
+    def matches(self, track, window, playlists, tracks, features=None,
+                excluded_tracks=frozenset()):
+        """
+        Return ``True`` if ``track`` matches the rule, without the limits
+        (``max_per_artist`` and ``limit``).
+
+        :param window: set of the keys of the playlists considered by the
+                       rule, see :meth:`get_window()`
+        :param excluded_tracks: set of the ids of the tracks of the excluded
+                                playlists which are not feston playlists
+        """
+        in_playlists = [playlists.find_by_id(key)
+                        for key in tracks.playlists_of(track)
+                        if key in playlists]
+
+        if not any(f"{p.user_id}:{p.object_id}" in window
+                   for p in in_playlists):
+            return False
+
+        if (track.object_id in excluded_tracks
+                or any(text in p.name for text in self.rule.exclude
+                       for p in in_playlists)):
+            return False
+
+        if self.rule.features:
+            track_features = features.get(track) if features else None
+            if not track_features:
+                return False
+
+            for name, (minimum, maximum) in self.rule.features.items():
+                if not minimum <= getattr(track_features, name) <= maximum:
+                    return False
+
+        return True
+
+    def evaluate(self, playlists, tracks, changelog, features=None,
+                 today=None, excluded=None):
+        """
+        Update the set of tracks matching the rule.
+
+        Only the tracks changed since the last evaluation, and the tracks
+        whose audio features were missing, are checked, unless the rule, or
+        the playlists it considers, changed.
+
+        Return the number of checked tracks.
+
+        :param playlists: a :class:`festune.index.FestonPlaylistsIndex`
+        :param tracks: a :class:`festune.index.TracksIndex`
+        :param changelog: a :class:`festune.changelog.ChangeLog`
+        :param features: a :class:`festune.features.AudioFeaturesCache`,
+                         required if the rule filters on audio features
+        :param today: date of the evaluation, default to today
+        :param excluded: an :class:`ExcludedPlaylists`, required if the rule
+                         excludes playlists which are not feston playlists
+        """
+        window = self.get_window(playlists, today)
+        excluded_version = []
+        excluded_tracks = frozenset()
+        if excluded is not None and self.rule.exclude:
+            excluded_version = excluded.version(self.rule.exclude)
+            excluded_tracks = excluded.tracks_of(self.rule.exclude)
+
+        changed_ids = None
+        if (self.digest == self.rule.digest and self.window == window
+                and self.excluded == excluded_version):
+            try:
+                changed_ids = set(self.missing_features)
+                for change in changelog.read_since(self.cursor):
+                    changed_ids.update(track_id for track_id, *_
+                                       in change.added + change.removed)
+            except festune.changelog.CursorExpired:
+                changed_ids = None
+
+        self.digest = self.rule.digest
+        self.window = window
+        self.excluded = excluded_version
+        self.cursor = changelog.last_cursor
+
+        if changed_ids is None:
+            # Evaluate from scratch
+            self.candidates = set()
+            self.missing_features = set()
+            to_check = list(tracks)
+        else:
+            to_check = []
+            for track_id in changed_ids:
+                self.candidates.discard(track_id)
+                self.missing_features.discard(track_id)
+                try:
+                    to_check.append(tracks.find_by_id(track_id))
+                except KeyError:
+                    continue
+
+        window_keys = set(window)
+        for track in to_check:
+            if self.rule.features and (features is None
+                                       or track not in features):
+                self.missing_features.add(track.object_id)
+
+            if self.matches(track, window_keys, playlists, tracks, features,
+                            excluded_tracks):
+                self.candidates.add(track.object_id)
+
+        return len(to_check)
+
+    def select(self, playlists, tracks):
+        """
+        Return the list of the ids of the tracks of the playlist: the most
+        recent candidates, within the limits of the rule, in chronological
+        order.
+        """
+        window = set(self.window)
+
+        def recency(track):
+            return max(
+                (playlists.find_by_id(key).year,
+                 playlists.find_by_id(key).month, position)
+                for key, position in track.playlists.items()
+                if key in playlists and ":".join(key) in window)
+
+        candidates = []
+        for track_id in self.candidates:
+            try:
+                candidates.append(tracks.find_by_id(track_id))
+            except KeyError:
+                continue
+
+        selected = []
+        by_artist = {}
+        for track in sorted(candidates, key=recency, reverse=True):
+            if self.rule.max_per_artist is not None:
+                artist = track.artists[0] if track.artists else None
+                by_artist[artist] = by_artist.get(artist, 0) + 1
+                if by_artist[artist] > self.rule.max_per_artist:
+                    continue
+
+            selected.append(track.object_id)
+            if self.rule.limit and len(selected) >= self.rule.limit:
+                break
+
+        return selected[::-1]
+
+    def diff(self, selected):
+        """
+        Return the tuple (to_add, to_remove) of track ids to get from the
+        pushed tracks to ``selected``.
+        """
+        selected_ids = set(selected)
+        pushed_ids = set(self.pushed)
+        return ([track_id for track_id in selected
+                 if track_id not in pushed_ids],
+                [track_id for track_id in self.pushed
+                 if track_id not in selected_ids])
+
+    def push(self, outbox, selected):
+        """
+        Queue in ``outbox`` (a :class:`festune.outbox.Outbox`) the minimal
+        changes of the playlist to get the tracks ``selected``.
+
+        The first time, the content of the playlist is unknown: all its tracks
+        are replaced.
+
+        Return the tuple (to_add, to_remove) of the changes.
+        """
+        if self.pushed is None:
+            outbox.replace(*self.rule.playlist, selected)
+            self.pushed = list(selected)
+            return list(selected), []
+
+        to_add, to_remove = self.diff(selected)
+        outbox.remove(*self.rule.playlist, to_remove)
+        outbox.add(*self.rule.playlist, to_add)
+
+        self.pushed = list(selected)
+        return to_add, to_remove
+
+
+def update_smart_playlists(outbox, rules, playlists, tracks, changelog,
+                           features=None, excluded=None):
+    """
+    Evaluate ``rules`` and queue the changes of their playlists in
+    ``outbox``.
+
+    See :meth:`SmartPlaylist.evaluate()` for the arguments.
+
+    Yield, for each rule, a tuple (rule, number of checked tracks, to_add,
+    to_remove).
+    """
+    for rule in rules:
+        smart_playlist = SmartPlaylist.load(rule)
+        nb_checked = smart_playlist.evaluate(playlists, tracks, changelog,
+                                             features, excluded=excluded)
+        to_add, to_remove = smart_playlist.push(
+            outbox, smart_playlist.select(playlists, tracks))
+
+        smart_playlist.save()
+        changelog.ack(smart_playlist.consumer, smart_playlist.cursor)
+        yield rule, nb_checked, to_add, to_remove
@@ -0,0 +1,190 @@
+# coding: utf-8
+"""
+Full text search in the names and artists of tracks.
+
+Names and artists are split in tokens, normalized (case and accents are
+ignored) and stored in an inverted index: token => ids of the tracks.
+
+A query is a list of terms, a track matches if it matches all terms. A term
+can be restricted to a field (``artist:daft`` or ``name:remix``), and a term
+ending with ``*`` matches all tokens starting with it (``remi*``). Several
+queries can be combined with ``|``: a track matches if it matches any of
+them.
+"""
+import bisect
+import collections
+import json
+import re
+import unicodedata
+
+import festune.data
+
+
+#: Name of the file storing the index
+SEARCH_INDEX_FILE = "search-index.json"
+
+#: Fields of the tracks indexed
+FIELDS = ("name", "artist")
+
+_TOKEN_REGEX = re.compile(r"\w+")
+
+
+def normalize(text):
+    """
+    Remove accents and case from ``text``.
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed
+                   if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text):
+    return _TOKEN_REGEX.findall(normalize(text))
+
+
+class SearchIndex:
+    """
+    Inverted index of the tracks, by track id.
+    """
+    def __init__(self, path=SEARCH_INDEX_FILE):
+        self.path = path
+        #: track_id => {field: tokens}
+        self.tokens_of = {}
+        #: field => token => set of track ids
+        self.postings = {field: collections.defaultdict(set)
+                         for field in FIELDS}
+        self._sorted_tokens = {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path=SEARCH_INDEX_FILE):
+        index = cls(path)
+        for track_id, tokens in festune.data.read_json(path, {}).items():
+            index._add_tokens(track_id, tokens)
+
+        return index
+
+    def save(self):
+        festune.data.write_file(self.path, json.dumps(self.tokens_of))
+        self.dirty = False
+
+    def __contains__(self, track):
+        return track.object_id in self.tokens_of
+
+    def __len__(self):
+        return len(self.tokens_of)
+
+    def add(self, track):
+        """
+        Index ``track``, if it is not indexed yet.
+
+        Tracks without an id (local files) are not indexed.
+        """
+        if not track.object_id or track.object_id in self.tokens_of:
+            return
+
+        self._add_tokens(track.object_id, {
+            "name": tokenize(track.name),
+            "artist": [token for artist in track.artists
+                       for token in tokenize(artist)],
+        })
+        self.dirty = True
+
+    def _add_tokens(self, track_id, tokens):
+        self.tokens_of[track_id] = tokens
+        for field in FIELDS:
+            postings = self.postings[field]
+            for token in tokens[field]:
+                if token not in postings:
+                    self._sorted_tokens.pop(field, None)
+
+                postings[token].add(track_id)
+
+    def remove(self, track):
+        """
+        Remove ``track`` from the index.
+        """
+        tokens = self.tokens_of.pop(track.object_id, None)
+        if tokens is None:
+            return
+
+        for field in FIELDS:
+            postings = self.postings[field]
+            for token in tokens[field]:
+                postings[token].discard(track.object_id)
+                if not postings[token]:
+                    del postings[token]
+                    self._sorted_tokens.pop(field, None)
+
+        self.dirty = True
+
+    def _match_prefix(self, field, prefix):
+        if field not in self._sorted_tokens:
+            self._sorted_tokens[field] = sorted(self.postings[field])
+
+        tokens = self._sorted_tokens[field]
+        matching = set()
+        for i in range(bisect.bisect_left(tokens, prefix), len(tokens)):
+            if not tokens[i].startswith(prefix):
+                break
+
+            matching.update(self.postings[field][tokens[i]])
+
+        return matching
+
+    def _match_term(self, term):
+        field, _, value = term.rpartition(":")
+        fields = (field, ) if field in FIELDS else FIELDS
+
+        is_prefix = value.endswith("*")
+        matching = set()
+        for token in tokenize(value):
+            token_matching = set()
+            for field in fields:
+                if is_prefix:
+                    token_matching |= self._match_prefix(field, token)
+                else:
+                    token_matching |= self.postings[field].get(token, set())
+
+            matching = token_matching if not matching else (
+                matching & token_matching)
+
+            if not matching:
+                break
+
+        return matching
+
+    def search(self, query):
+        """
+        Return the set of the ids of the tracks matching ``query``.
+        """
+        result = set()
+        for alternative in query.split("|"):
+            matching = None
+            for term in alternative.split():
+                term_matching = self._match_term(term)
+                matching = (term_matching if matching is None
+                            else matching & term_matching)
+
+                if not matching:
+                    break
+
+            result |= matching or set()
+
+        return result
+
+
+def search(tracks, query):
+    """
+    Return the list of tracks of the :class:`festune.index.TracksIndex`
+    ``tracks`` matching ``query``.
+    """
+    result = []
+    for track_id in tracks.search_index.search(query):
+        try:
+            result.append(tracks.find_by_id(track_id))
+        except KeyError:
+            # The index stored on disk may know tracks which have been removed
+            continue
+
+    return result
@@ -1,12 +1,14 @@
 # coding: utf-8
-import collections.abc
+"""
+Authentication and base data objects of the Spotify API.
+
+spotipy (and requests) are slow to import, they are imported only when a
+client is actually needed: :class:`Spotify` is defined in
+:mod:`festune.client`, but can still be accessed from this module.
+"""
 import dataclasses
 import pathlib
 import sys
-import webbrowser
-
-import spotipy
-import spotipy.oauth2
 
 import festune
 import festune.data
@@ -17,6 +19,9 @@ import settings
 #: Name of the file in which the token is stored.
 DEFAULT_TOKEN_FILE = "spotify-token"
 
+#: Maximum number of tracks sent or requested at once, enforced by the API
+MAX_TRACKS_PER_REQUEST = 100
+
 
 class Error(festune.exceptions.Error):
     pass
@@ -72,6 +77,8 @@ class Token:
         Opens user's browser to ask for spotify permissions and stores the
         token with the required scope.
         """
+        import webbrowser
+
         oauth = self._get_oauth()
 
         print("Opening your browser...")
@@ -91,75 +98,14 @@ class Token:
         print("Thank you")
 
     def _get_oauth(self):
+        import spotipy.oauth2
+
         return spotipy.oauth2.SpotifyOAuth(
             self.client_id, self.client_secret, self.redirection_url,
             scope=" ".join(festune.SPOTIFY_SCOPES),
             cache_path=festune.data.get_filename(self._token_file))
 
 
-class ResultWrapper(collections.abc.MutableMapping):
-    def __init__(self, client, result):
-        self.client = client
-        self.result = result
-
-    def __len__(self):
-        return len(self.result)
-
-    def __iter__(self):
-        return iter(self.result)
-
-    def __getitem__(self, key):
-        return self.result[key]
-
-    def __contains__(self, key):
-        return key in self.result
-
-    def __setitem__(self, key, value):
-        self.result[key] = value
-
-    def __delitem__(self, key):
-        del self.result[key]
-
-    def __call__(self, method, *args, **kwargs):
-        getattr(self.result, method)(*args, **kwargs)
-
-    def __str__(self):
-        return str(self.result)
-
-    def __repr__(self):
-        return repr(self.result)
-
-    def paginate(self):
-        """
-        Iterate through the results and load the next page(s).
-        """
-        result = self.result
-        while result:
-            yield from result['items']
-            result = self.client.next(result)
-
-
-class Spotify(spotipy.Spotify):
-    """
-    Add pagination helpers to some requests::
-
-        for playlist in spotify.current_user_playlists().paginate():
-            pass
-
-    """
-    def _get(self, url, args=None, payload=None, **kwargs):
-        result = super()._get(url, args, payload, **kwargs)
-
-        if result and "limit" in kwargs and "offset" in kwargs:
-            return ResultWrapper(self, result)
-
-        return result
-
-    def next(self, result):
-        result = super().next(result)
-        return ResultWrapper(self, result) if result else result
-
-
 @dataclasses.dataclass
 class Object(festune.data.DataObject):
     object_id: str
@@ -185,12 +131,25 @@ def login():
         print(f"Error: {exc}", file=sys.stderr)
 
 
-def get_spotify():
+def get_spotify(tracer=None):
     """
     Return a spotify api object with the stored token.
+
+    :param tracer: a :class:`festune.tracing.Tracer` recording the calls to
+                   the API
     """
+    import festune.client
+
     token = Token.from_settings().get_token()
     if not token:
         raise Error("Can not load user's token")
 
-    return Spotify(auth=token)
+    return festune.client.Spotify(auth=token, tracer=tracer)
+
+
+def __getattr__(name):
+    if name in ("Spotify", "ResultWrapper"):
+        import festune.client
+        return getattr(festune.client, name)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
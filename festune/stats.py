@@ -0,0 +1,188 @@
+# coding: utf-8
+"""
+Statistics on the feston playlists.
+
+Statistics are computed with NumPy on the integer-encoded tables built by
+:func:`festune.columnar.build_tables()`. A report only depends on the
+snapshots of the playlists, it is cached on disk until one of them changes.
+"""
+import hashlib
+import json
+
+import numpy
+
+import festune.columnar
+import festune.data
+
+
+#: Name of the file caching the last report
+STATS_FILE = "stats.json"
+
+#: Number of artists listed in the "top artists" rankings
+NB_TOP_ARTISTS = 10
+
+
+def get_cache_key(playlists):
+    """
+    Return a key identifying the state of ``playlists``: it changes as soon as
+    a playlist is added, removed or modified.
+    """
+    snapshots = sorted(f"{p.user_id}:{p.object_id}:{p.snapshot_id}"
+                       for p in playlists)
+    return hashlib.sha1("\n".join(snapshots).encode("utf-8")).hexdigest()
+
+
+def _explode_artists(tables):
+    """
+    Return two arrays (playlists, artists) with one row per artist of each
+    track of each playlist.
+    """
+    memberships = tables["memberships"]
+    artists = tables["tracks"]["artists"]
+
+    track = memberships["track"].values
+    starts = artists.offsets[track]
+    counts = artists.offsets[track + 1] - starts
+
+    # Indices of the artists of each membership row, in the flat array of
+    # artists: starts[i], starts[i] + 1, ..., starts[i] + counts[i] - 1
+    row_starts = numpy.cumsum(counts) - counts
+    indices = (numpy.arange(counts.sum())
+               + numpy.repeat(starts - row_starts, counts))
+
+    return (numpy.repeat(memberships["playlist"].values, counts),
+            artists.values[indices])
+
+
+def _top(codes, counts, dictionary, nb_top=NB_TOP_ARTISTS):
+    order = numpy.lexsort((codes, -counts))[:nb_top]
+    return [[dictionary[code], int(count)]
+            for code, count in zip(codes[order], counts[order])]
+
+
+def _artists_jaccard(pairs_playlist, pairs_artist, nb_playlists):
+    """
+    Return the matrix of the Jaccard index of the sets of artists of each pair
+    of playlists.
+
+    ``pairs_playlist`` and ``pairs_artist`` are unique pairs (playlist,
+    artist).
+    """
+    sizes = numpy.bincount(pairs_playlist, minlength=nb_playlists)
+
+    # Artists of a single playlist only contribute to the size of its set, the
+    # intersections are computed on the others.
+    _, shared_artist, frequency = numpy.unique(
+        pairs_artist, return_inverse=True, return_counts=True)
+    shared = frequency[shared_artist] > 1
+    _, columns = numpy.unique(shared_artist[shared], return_inverse=True)
+
+    nb_columns = columns.max() + 1 if columns.size else 0
+    matrix = numpy.zeros((nb_playlists, nb_columns), dtype=numpy.float32)
+    matrix[pairs_playlist[shared], columns] = 1
+    intersections = matrix @ matrix.T
+
+    unions = sizes[:, None] + sizes[None, :] - intersections
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        jaccard = numpy.where(unions > 0, intersections / unions, 0)
+
+    # Intersections only count the shared artists, but a set is equal to
+    # itself
+    numpy.fill_diagonal(jaccard, (sizes > 0).astype(float))
+    return jaccard
+
+
+def compute(playlists, tracks):
+    """
+    Compute the statistics report of the indexes.
+
+    :param playlists: a :class:`festune.index.FestonPlaylistsIndex`
+    :param tracks: a :class:`festune.index.TracksIndex`
+    :return: a json-serializable dict
+    """
+    tables = festune.columnar.build_tables(playlists, tracks,
+                                           track_columns=("artists", ))
+    nb_playlists = len(tables["playlists"]["object_id"])
+    nb_tracks = len(tables["tracks"]["artists"])
+    membership_playlist = tables["memberships"]["playlist"].values
+    membership_track = tables["memberships"]["track"].values
+
+    months = [f"{year:04d}-{month:02d}" for year, month in zip(
+        tables["playlists"]["year"].values,
+        tables["playlists"]["month"].values)]
+
+    tracks_per_month = numpy.bincount(membership_playlist,
+                                      minlength=nb_playlists)
+
+    # Playlists are sorted by date, a track is repeated in a playlist if it
+    # is in a playlist with a lower id.
+    first_playlist = numpy.full(nb_tracks, nb_playlists, dtype=numpy.int32)
+    numpy.minimum.at(first_playlist, membership_track, membership_playlist)
+    repeated = membership_playlist > first_playlist[membership_track]
+
+    occurrences = numpy.bincount(membership_track, minlength=nb_tracks)
+    duplicated = occurrences[membership_track] > 1
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        repeat_rate = numpy.nan_to_num(numpy.bincount(
+            membership_playlist, weights=repeated,
+            minlength=nb_playlists) / tracks_per_month)
+        duplicate_rate = numpy.nan_to_num(numpy.bincount(
+            membership_playlist, weights=duplicated,
+            minlength=nb_playlists) / tracks_per_month)
+
+    artist_playlist, artist = _explode_artists(tables)
+    artists_dictionary = tables["tracks"]["artists"].dictionary
+    nb_artists = len(artists_dictionary)
+
+    overall_codes = numpy.arange(nb_artists)
+    top_artists = _top(overall_codes, numpy.bincount(
+        artist, minlength=nb_artists), artists_dictionary)
+
+    pairs, pair_counts = numpy.unique(
+        artist_playlist.astype(numpy.int64) * max(nb_artists, 1) + artist,
+        return_counts=True)
+    pairs_playlist, pairs_artist = numpy.divmod(pairs, max(nb_artists, 1))
+    boundaries = numpy.searchsorted(pairs_playlist,
+                                    numpy.arange(nb_playlists + 1))
+
+    top_artists_per_month = {}
+    for playlist_id, month in enumerate(months):
+        start, end = boundaries[playlist_id], boundaries[playlist_id + 1]
+        top_artists_per_month[month] = _top(
+            pairs_artist[start:end], pair_counts[start:end],
+            artists_dictionary)
+
+    jaccard = _artists_jaccard(pairs_playlist, pairs_artist, nb_playlists)
+
+    return {
+        "key": get_cache_key(playlists),
+        "months": months,
+        "tracks_per_month": tracks_per_month.tolist(),
+        "top_artists": top_artists,
+        "top_artists_per_month": top_artists_per_month,
+        "artists_jaccard": jaccard.round(4).tolist(),
+        "repeat_rate": repeat_rate.round(4).tolist(),
+        "duplicate_rate": duplicate_rate.round(4).tolist(),
+    }
+
+
+def get_report(playlists, tracks):
+    """
+    Return the statistics report, from the cache if the playlists didn't
+    change since it has been computed.
+    """
+    key = get_cache_key(playlists)
+    try:
+        with festune.data.open_file(STATS_FILE, "r") as stats_file:
+            report = json.loads(stats_file.read())
+
+        if report.get("key") == key:
+            return report
+    except (FileNotFoundError, ValueError):
+        pass
+
+    report = compute(playlists, tracks)
+    festune.data.write_file(STATS_FILE, json.dumps(report))
+
+    return report
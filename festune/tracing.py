@@ -0,0 +1,258 @@
+# coding: utf-8
+"""
+Trace the calls to the Spotify API.
+
+Each call made by :class:`festune.client.Spotify` is recorded as a trace
+event: a dict with the ``method``, the ``endpoint`` template (ids are
+replaced by ``{id}``, see :func:`endpoint_template()`), the ``playlist`` id
+(if any), the HTTP ``status``, the size of the response (``bytes``), the
+``latency``, the number of ``retries`` and the time spent waiting between
+retries (``throttle_wait``), in seconds.
+
+The events of the last run are written in :data:`TRACE_FILE` (one JSON
+object per line). Events are also aggregated by method and endpoint in
+latency histograms, and by playlist (number of calls, total latency and
+size), which are kept across runs in :data:`METRICS_FILE` and exported in the
+OpenMetrics text format in :data:`OPENMETRICS_FILE`.
+"""
+import json
+import threading
+import time
+import urllib.parse
+
+import festune.data
+
+
+#: Name of the file storing the events of the last run
+TRACE_FILE = "api-trace.jsonl"
+
+#: Name of the file storing the aggregated metrics
+METRICS_FILE = "api-metrics.json"
+
+#: Name of the file in which metrics are exported for a scraper
+OPENMETRICS_FILE = "api-metrics.txt"
+
+#: Upper bounds of the buckets of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+
+#: In the path of an endpoint, the segment following one of these is an id
+_COLLECTIONS = frozenset(("albums", "artists", "audio-analysis",
+                          "audio-features", "episodes", "playlists", "shows",
+                          "tracks", "users"))
+
+#: Prefix of the names of the exported metrics
+_METRICS_PREFIX = "festune_api"
+
+
+def _split_path(url):
+    path = urllib.parse.urlsplit(url).path
+    segments = path.strip("/").split("/")
+    # Remove the version of the API
+    if segments and segments[0] == "v1":
+        segments = segments[1:]
+
+    return segments
+
+
+def endpoint_template(url):
+    """
+    Return the path of ``url`` where ids are replaced by ``{id}``, for
+    instance ``users/{id}/playlists/{id}/tracks``.
+    """
+    segments = _split_path(url)
+    for i in range(1, len(segments)):
+        if segments[i - 1] in _COLLECTIONS:
+            segments[i] = "{id}"
+
+    return "/".join(segments)
+
+
+def playlist_of(url):
+    """
+    Return the id of the playlist targeted by ``url``, or ``None``.
+    """
+    segments = _split_path(url)
+    for i in range(1, len(segments)):
+        if segments[i - 1] == "playlists":
+            return segments[i]
+
+    return None
+
+
+class Histogram:
+    """
+    Cumulative histogram of latencies, as in OpenMetrics: ``buckets[i]``
+    counts the observations lower than or equal to ``LATENCY_BUCKETS[i]``.
+    """
+    def __init__(self, buckets=None, count=0, total=0.):
+        self.buckets = buckets or [0] * len(LATENCY_BUCKETS)
+        self.count = count
+        self.total = total
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+        self.count += 1
+        self.total += value
+
+    def to_json(self):
+        return {"buckets": self.buckets, "count": self.count,
+                "total": self.total}
+
+
+class Tracer:
+    """
+    Record trace events and aggregate them in metrics by endpoint.
+
+    Events can be recorded from several threads.
+    """
+    def __init__(self):
+        self.events = []
+        #: "method endpoint" => :class:`Histogram`
+        self.latencies = {}
+        #: "method endpoint" => {counter: value}, counters are "bytes",
+        #: "retries", "throttle_wait" and the HTTP statuses
+        self.counters = {}
+        #: playlist id => {"count", "latency", "bytes"}
+        self.playlists = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls):
+        tracer = cls()
+        metrics = festune.data.read_json(METRICS_FILE)
+        if metrics is None:
+            return tracer
+
+        tracer.playlists = metrics.get("playlists", {})
+
+        # Histograms are reset if the buckets changed
+        if metrics["buckets"] == list(LATENCY_BUCKETS):
+            tracer.latencies = {key: Histogram(**histogram) for key, histogram
+                                in metrics["latencies"].items()}
+            tracer.counters = metrics["counters"]
+
+        return tracer
+
+    def save(self):
+        """
+        Write the events and the metrics on disk.
+        """
+        with self._lock:
+            festune.data.write_file(TRACE_FILE, "".join(
+                json.dumps(event) + "\n" for event in self.events))
+            festune.data.write_file(METRICS_FILE, json.dumps({
+                "buckets": list(LATENCY_BUCKETS),
+                "latencies": {key: histogram.to_json()
+                              for key, histogram in self.latencies.items()},
+                "counters": self.counters,
+                "playlists": self.playlists,
+            }))
+            festune.data.write_file(OPENMETRICS_FILE, self.to_openmetrics())
+
+    def record(self, method, url, status, size, latency, retries=0,
+               throttle_wait=0.):
+        """
+        Record a call and return its trace event.
+        """
+        event = {
+            "time": time.time(),
+            "method": method,
+            "endpoint": endpoint_template(url),
+            "playlist": playlist_of(url),
+            "status": status,
+            "bytes": size,
+            "latency": latency,
+            "retries": retries,
+            "throttle_wait": throttle_wait,
+        }
+
+        key = f"{method} {event['endpoint']}"
+        with self._lock:
+            self.events.append(event)
+            self.latencies.setdefault(key, Histogram()).observe(latency)
+
+            counters = self.counters.setdefault(key, {})
+            for name, value in (("bytes", size), ("retries", retries),
+                                ("throttle_wait", throttle_wait),
+                                (str(status), 1)):
+                counters[name] = counters.get(name, 0) + value
+
+            if event["playlist"]:
+                playlist = self.playlists.setdefault(
+                    event["playlist"], {"count": 0, "latency": 0., "bytes": 0})
+                playlist["count"] += 1
+                playlist["latency"] += latency
+                playlist["bytes"] += size
+
+        return event
+
+    def to_openmetrics(self):
+        """
+        Return the metrics in the OpenMetrics text format.
+        """
+        def labels(key, **extra):
+            method, endpoint = key.split(" ", 1)
+            pairs = dict(method=method, endpoint=endpoint, **extra)
+            return "{" + ",".join(f'{name}="{value}"'
+                                  for name, value in pairs.items()) + "}"
+
+        name = f"{_METRICS_PREFIX}_request_duration_seconds"
+        lines = [f"# TYPE {name} histogram",
+                 f"# UNIT {name} seconds",
+                 f"# HELP {name} Latency of the calls to the API."]
+        for key, histogram in sorted(self.latencies.items()):
+            for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+                lines.append(f"{name}_bucket{labels(key, le=bound)} {count}")
+
+            lines.append(
+                f"{name}_bucket{labels(key, le='+Inf')} {histogram.count}")
+            lines.append(f"{name}_count{labels(key)} {histogram.count}")
+            lines.append(f"{name}_sum{labels(key)} {histogram.total}")
+
+        for counter, unit, description in (
+                ("bytes", "bytes", "Size of the responses."),
+                ("retries", None, "Number of retried calls."),
+                ("throttle_wait", "seconds",
+                 "Time spent waiting before retrying calls.")):
+            name = f"{_METRICS_PREFIX}_{counter}"
+            if unit and not name.endswith(unit):
+                name = f"{name}_{unit}"
+
+            lines.append(f"# TYPE {name} counter")
+            if unit:
+                lines.append(f"# UNIT {name} {unit}")
+            lines.append(f"# HELP {name} {description}")
+            for key, counters in sorted(self.counters.items()):
+                lines.append(
+                    f"{name}_total{labels(key)} {counters.get(counter, 0)}")
+
+        name = f"{_METRICS_PREFIX}_responses"
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"# HELP {name} Number of responses by HTTP status.")
+        for key, counters in sorted(self.counters.items()):
+            for status, count in sorted(counters.items()):
+                if status.isdigit():
+                    lines.append(
+                        f"{name}_total{labels(key, status=status)} {count}")
+
+        for counter, name, unit, description in (
+                ("count", "playlist_calls", None,
+                 "Number of calls to the API about a playlist."),
+                ("latency", "playlist_duration_seconds", "seconds",
+                 "Total latency of the calls about a playlist."),
+                ("bytes", "playlist_bytes", "bytes",
+                 "Total size of the responses about a playlist.")):
+            name = f"{_METRICS_PREFIX}_{name}"
+            lines.append(f"# TYPE {name} counter")
+            if unit:
+                lines.append(f"# UNIT {name} {unit}")
+            lines.append(f"# HELP {name} {description}")
+            for playlist_id, playlist in sorted(self.playlists.items()):
+                lines.append(f'{name}_total{{playlist="{playlist_id}"}} '
+                             f"{playlist[counter]}")
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
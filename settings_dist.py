@@ -17,3 +17,29 @@ DATA_DIR = "data"
 
 # tuple user_id, playlist_id of the "rotating feston playlist"
 ROTATING_PLAYLIST = None
+
+#: Fetch the audio features (tempo, energy, ...) of new tracks after each
+#: refresh, see ``festune.features``.
+ENRICH_AUDIO_FEATURES = False
+
+#: Which occurrence of a duplicated track is kept by the
+#: ``resolve_duplicates`` action: in the "oldest" or "newest" feston
+#: playlist.
+DUPLICATES_POLICY = "oldest"
+
+#: Tracks which are not in any playlist anymore are removed automatically when
+#: they are at least this fraction of the stored tracks, see the ``gc``
+#: action. ``None`` disables the automatic removal.
+GC_THRESHOLD = 0.1
+
+#: Smart playlists, updated by the ``update_smart`` action. Each smart playlist
+#: is a dict of the arguments of ``festune.rules.Rule``, for instance::
+#:
+#:     {
+#:         "name": "recent",
+#:         "playlist": ("user_id", "playlist_id"),
+#:         "within_days": 60,
+#:         "exclude": ["spéciale"],
+#:         "max_per_artist": 2,
+#:     }
+SMART_PLAYLISTS = []
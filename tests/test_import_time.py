@@ -0,0 +1,66 @@
+# coding: utf-8
+"""
+The command line interface must start quickly: heavy modules are only imported
+by the actions needing them.
+"""
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+#: Maximum time to import ``festune.__main__``, in seconds
+IMPORT_TIME_BUDGET = 0.15
+
+#: Modules which must not be imported by ``festune.__main__``
+HEAVY_MODULES = ("spotipy", "requests", "numpy")
+
+_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+_SCRIPT = """
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import festune.__main__
+elapsed = time.perf_counter() - start
+
+print(json.dumps({
+    "elapsed": elapsed,
+    "imported": [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+class ImportTimeTestCase(unittest.TestCase):
+    def import_main(self):
+        with tempfile.TemporaryDirectory() as settings_dir:
+            with open(os.path.join(settings_dir, "settings.py"), "w") as f:
+                f.write("from settings_dist import *  # noqa\n"
+                        f"DATA_DIR = {os.path.join(settings_dir, 'data')!r}\n")
+
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+                (settings_dir, str(_ROOT))))
+            output = subprocess.run(
+                [sys.executable, "-c", _SCRIPT % (HEAVY_MODULES, )],
+                env=env, cwd=settings_dir, check=True, capture_output=True,
+                text=True).stdout
+
+        return json.loads(output)
+
+    def test_heavy_modules_not_imported(self):
+        self.assertEqual(self.import_main()["imported"], [])
+
+    def test_import_time(self):
+        # The best of several runs, to be less sensitive to the load of the
+        # machine
+        elapsed = min(self.import_main()["elapsed"] for _ in range(3))
+        self.assertLess(elapsed, IMPORT_TIME_BUDGET)
+
+
+if __name__ == "__main__":
+    unittest.main()